@@ -6,14 +6,22 @@ import torch
 import transformers as trf
 import tqdm
 import logging
-import copy
-from typing import List, Union, Optional
+import itertools
+import os
+import hashlib
+import shutil
+from typing import List, Union, Optional, Tuple
 
 import generatools.utils.logging as utils_logging
 
 
 logger = logging.getLogger(__name__)
 
+# Number of texts passed at once to the tokenizer
+_TOKENIZATION_BATCH_SIZE = 10000
+# Arrays of GPTDataset stored by GPTDataset.save_to_disk
+_GPTDATASET_ARRAYS = ("offsets", "input_ids", "attention_mask")
+
 
 class GPTDataset(torch.utils.data.Dataset):
     def __init__(
@@ -27,6 +35,7 @@ class GPTDataset(torch.utils.data.Dataset):
         drop_too_long: bool = False,
         special_bos: Union[str, None] = None,
         special_eos: Union[str, None] = None,
+        cache_dir: Union[str, None] = None,
     ) -> None:
         """Dataset class for causal GPT-like LM models
 
@@ -52,6 +61,12 @@ class GPTDataset(torch.utils.data.Dataset):
             special_bos
         special_eos : Union[str, None]
             special_eos
+        cache_dir : Union[str, None]
+            If not None, directory where tokenized docs are cached. The cache
+            is keyed on a hash of the texts, the tokenizer (name, vocabulary
+            size, padding side and special tokens) and the other arguments, so
+            that an identical call loads the docs instead of re-tokenizing.
+            Default to None.
         """
         # Init
         preproc_texts = texts
@@ -67,26 +82,46 @@ class GPTDataset(torch.utils.data.Dataset):
             truncation=truncation,
             drop_too_long=drop_too_long,
         )
-        # Preprocessing
-        if special_bos:
+        # Reuse the tokenized docs cached by an identical call
+        cache_path = None
+        if cache_dir is not None:
+            cache_key = self._get_cache_key(
+                texts=texts,
+                tokenizer=tokenizer,
+                args=dict(
+                    concat_token=concat_token,
+                    padding=padding,
+                    truncation=truncation,
+                    max_length=max_length,
+                    drop_too_long=drop_too_long,
+                    special_bos=special_bos,
+                    special_eos=special_eos,
+                ),
+            )
+            cache_path = os.path.join(cache_dir, cache_key)
+            if os.path.isdir(cache_path):
+                logger.info(f"Loading tokenized docs from {cache_path}")
+                self._load_arrays(dirpath=cache_path, mmap=True)
+                return
+        # Preprocessing. Special bos/eos tokens are added as ids after
+        # tokenization. Other bos/eos strings are concatenated to the texts.
+        bos_ids = self._get_special_token_ids(
+            tokenizer=tokenizer, token=special_bos
+        )
+        eos_ids = self._get_special_token_ids(
+            tokenizer=tokenizer, token=special_eos
+        )
+        if special_bos and not bos_ids:
             preproc_texts = [special_bos + text for text in preproc_texts]
-        if special_eos:
+        if special_eos and not eos_ids:
             preproc_texts = [text + special_eos for text in preproc_texts]
-        if (
-            padding
-            or truncation
-            or drop_too_long
-            or (concat_token is not None)
-        ):
-            tokenizer_args["max_length"] = max_length
         # Concatenator
         if concat_token is not None:
             raise NotImplementedError("Concatenation is yet to be implemented")
-        # Padding: change tokenizer arg
-        if padding:
-            tokenizer_args["padding"] = "max_length"
-        # Truncation: change tokenizer arg
+        # Truncation: change tokenizer arg. Padding is not delegated to the
+        # tokenizer, but applied once on the token arrays afterward.
         if truncation:
+            tokenizer_args["max_length"] = max_length
             tokenizer_args["truncation"] = True
         if drop_too_long:
             # We increase a bit the max_length used during tokenization, so
@@ -96,45 +131,106 @@ class GPTDataset(torch.utils.data.Dataset):
             # this specific length afterward.
             tokenizer_args["max_length"] = max_length + 1
             tokenizer_args["truncation"] = True
-        # Tokenization
-        tok_data = [
-            tokenizer(text=text, **tokenizer_args)
-            for text in tqdm.tqdm(preproc_texts, desc="Tokenization")
-        ]
+        # When bos/eos ids are added after tokenization, truncation is applied
+        # after this addition
+        post_tokenizer_args = dict()
+        if bos_ids or eos_ids:
+            post_tokenizer_args, tokenizer_args = tokenizer_args, dict()
+        # Tokenization, by batches of texts so that fast tokenizers can
+        # process each batch in a single call. Tokens of all docs are stored
+        # in contiguous arrays, docs being delimited by their lengths.
+        batches_lens = [np.zeros(0, dtype=np.int64)]
+        batches_input_ids = [np.zeros(0, dtype=np.int32)]
+        batches_attention_mask = [np.zeros(0, dtype=np.int8)]
+        # Progress bar refreshed at most once per second, and disabled when
+        # stderr is not a TTY
+        with tqdm.tqdm(
+            total=len(preproc_texts),
+            desc="Tokenization",
+            mininterval=1.0,
+            disable=None,
+        ) as pbar:
+            for batch_start in range(
+                0, len(preproc_texts), _TOKENIZATION_BATCH_SIZE
+            ):
+                batch_end = batch_start + _TOKENIZATION_BATCH_SIZE
+                batch_texts = preproc_texts[batch_start:batch_end]
+                batch_tok = tokenizer(text=batch_texts, **tokenizer_args)
+                if bos_ids or eos_ids:
+                    batch_tok = self._add_special_token_ids(
+                        input_ids=batch_tok["input_ids"],
+                        bos_ids=bos_ids,
+                        eos_ids=eos_ids,
+                        **post_tokenizer_args,
+                    )
+                batch_lens = np.fromiter(
+                    (len(ids) for ids in batch_tok["input_ids"]),
+                    dtype=np.int64,
+                    count=len(batch_texts),
+                )
+                batch_n_tokens = int(batch_lens.sum())
+                batches_lens.append(batch_lens)
+                batches_input_ids.append(
+                    np.fromiter(
+                        itertools.chain.from_iterable(batch_tok["input_ids"]),
+                        dtype=np.int32,
+                        count=batch_n_tokens,
+                    )
+                )
+                batches_attention_mask.append(
+                    np.fromiter(
+                        itertools.chain.from_iterable(
+                            batch_tok["attention_mask"]
+                        ),
+                        dtype=np.int8,
+                        count=batch_n_tokens,
+                    )
+                )
+                pbar.update(len(batch_texts))
+        docs_lens = np.concatenate(batches_lens)
+        input_ids = np.concatenate(batches_input_ids)
+        attention_mask = np.concatenate(batches_attention_mask)
         # Drop sentences that are too long
         if drop_too_long:
-            n_whole_data = len(
-                tok_data
-            )  #  Keeping track of original # of data
-            #  Find datapoints that are too long (length equal to max_length+1
-            #  and the last token is not and eos or padding token)
-            tok_data_lens = [len(doc["input_ids"]) for doc in tok_data]
-            assert max(tok_data_lens) <= max_length + 1  #  Enforced above
-            too_long_idx = [
-                i
-                for i, toks in enumerate(tok_data)
-                if (len(toks["input_ids"]) == max_length + 1)
-                and toks["input_ids"][-1]
-                not in [tokenizer.eos_token_id, tokenizer.pad_token_id]
+            n_whole_data = len(docs_lens)  # Keeping track of original # data
+            tail_ids = [
+                tok_id
+                for tok_id in [tokenizer.eos_token_id, tokenizer.pad_token_id]
+                if tok_id is not None
             ]
-            tok_data = [
-                tok_data[i]
-                for i in range(len(tok_data))
-                if i not in too_long_idx
-            ]
-            # Truncate data to the right length
-            for i in range(len(tok_data)):
-                if len(tok_data[i]["input_ids"]) == max_length + 1:
-                    del tok_data[i]["input_ids"][-1]
-                    del tok_data[i]["attention_mask"][-1]
-            assert (
-                max([len(doc["input_ids"]) for doc in tok_data]) <= max_length
+            (
+                docs_lens,
+                input_ids,
+                attention_mask,
+                n_dropped,
+            ) = self._mark_and_trim(
+                docs_lens=docs_lens,
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_length=max_length,
+                tail_ids=tail_ids,
             )
             logger.info(
-                f"Dropped {len(too_long_idx)}/{n_whole_data} docs for which num of"
+                f"Dropped {n_dropped}/{n_whole_data} docs for which num of"
                 f" tokens was greater than {max_length}"
             )
-        self.tok_data = tok_data
+        # Padding, done once for all docs on the token arrays
+        if padding:
+            docs_lens, input_ids, attention_mask = self._pad(
+                docs_lens=docs_lens,
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_length=max_length,
+                pad_id=tokenizer.pad_token_id,
+                left=tokenizer.padding_side == "left",
+            )
+        # Doc i spans offsets[i]:offsets[i + 1] in the token arrays
+        self._offsets = np.zeros(len(docs_lens) + 1, dtype=np.int64)
+        np.cumsum(docs_lens, out=self._offsets[1:])
+        self._input_ids = input_ids
+        self._attention_mask = attention_mask
+        if cache_path is not None:
+            self._save_to_cache(cache_path=cache_path)
 
     def _check_args(
         self,
@@ -200,37 +296,290 @@ class GPTDataset(torch.utils.data.Dataset):
                     " None",
                 )
 
-    def __getitem__(self, idx):
-        return self.tok_data[idx]
+    def _get_special_token_ids(
+        self,
+        tokenizer: trf.tokenization_utils.PreTrainedTokenizerBase,
+        token: Union[str, None],
+    ) -> List[int]:
+        """Ids of `token` if it is a special token of the tokenizer, [] else"""
+        if token and token in tokenizer.all_special_tokens:
+            return tokenizer.encode(token, add_special_tokens=False)
+        return []
+
+    def _get_cache_key(
+        self,
+        texts: List[str],
+        tokenizer: trf.tokenization_utils.PreTrainedTokenizerBase,
+        args: dict,
+    ) -> str:
+        """Hash of everything the tokenized docs depend on"""
+        hasher = hashlib.blake2b(digest_size=20)
+        tokenizer_desc = (
+            type(tokenizer).__name__,
+            tokenizer.name_or_path,
+            len(tokenizer),
+            tokenizer.padding_side,
+            tokenizer.all_special_tokens,
+        )
+        hasher.update(repr((tokenizer_desc, sorted(args.items()))).encode())
+        for text in texts:
+            text_bytes = text.encode()
+            # Length prefix, so that texts boundaries are part of the hash
+            hasher.update(len(text_bytes).to_bytes(8, "little"))
+            hasher.update(text_bytes)
+        return hasher.hexdigest()
+
+    def _save_to_cache(self, cache_path: str) -> None:
+        """Save arrays to `cache_path`, making them visible all at once"""
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        self.save_to_disk(tmp_path)
+        try:
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # Already cached by a concurrent call
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        logger.info(f"Cached tokenized docs to {cache_path}")
+
+    def _load_arrays(self, dirpath: str, mmap: bool) -> None:
+        """Set the arrays saved with `save_to_disk` as attributes"""
+        for name in _GPTDATASET_ARRAYS:
+            array = np.load(
+                os.path.join(dirpath, f"{name}.npy"),
+                mmap_mode="r" if mmap else None,
+            )
+            setattr(self, f"_{name}", array)
+
+    def _add_special_token_ids(
+        self,
+        input_ids: List[List[int]],
+        bos_ids: List[int],
+        eos_ids: List[int],
+        max_length: Union[int, None] = None,
+        truncation: bool = False,
+    ) -> dict:
+        """Add bos/eos ids to tokenized texts, then truncate"""
+        input_ids = [bos_ids + ids + eos_ids for ids in input_ids]
+        if truncation:
+            input_ids = [ids[:max_length] for ids in input_ids]
+        attention_mask = [[1] * len(ids) for ids in input_ids]
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+    def _mark_and_trim(
+        self,
+        docs_lens: np.ndarray,
+        input_ids: np.ndarray,
+        attention_mask: np.ndarray,
+        max_length: int,
+        tail_ids: List[int],
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+        """Drop docs longer than max_length, on contiguous token arrays
+
+        Docs are expected to be tokenized with truncation to max_length + 1.
+        A doc of length max_length + 1 is too long unless its last token is in
+        `tail_ids` (eos or padding), in which case only this token is trimmed.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray, np.ndarray, int]
+            (docs lengths, input ids, attention mask) of the kept docs, and
+            number of dropped docs
+        """
+        # Only docs of length max_length + 1 need be dropped or trimmed
+        full_idx = np.flatnonzero(docs_lens > max_length)
+        if not len(full_idx):
+            return docs_lens, input_ids, attention_mask, 0
+        full_last_pos = np.cumsum(docs_lens)[full_idx] - 1
+        full_too_long = ~np.isin(input_ids[full_last_pos], tail_ids)
+        keep_docs = np.ones(len(docs_lens), dtype=bool)
+        keep_docs[full_idx[full_too_long]] = False
+        # Single token-level pass: tokens of kept docs, but the trimmed ones
+        keep_tokens = np.repeat(keep_docs, docs_lens)
+        keep_tokens[full_last_pos] = False
+        return (
+            np.minimum(docs_lens[keep_docs], max_length),
+            input_ids[keep_tokens],
+            attention_mask[keep_tokens],
+            int(full_too_long.sum()),
+        )
+
+    def _pad(
+        self,
+        docs_lens: np.ndarray,
+        input_ids: np.ndarray,
+        attention_mask: np.ndarray,
+        max_length: int,
+        pad_id: int,
+        left: bool,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Pad docs shorter than max_length, on contiguous token arrays
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray, np.ndarray]
+            (docs lengths, input ids, attention mask) after padding
+        """
+        padded_lens = np.maximum(docs_lens, max_length)
+        padded_ends = np.cumsum(padded_lens)
+        padded_starts = padded_ends - padded_lens
+        if left:
+            padded_starts += padded_lens - docs_lens
+        padded_input_ids = np.full(
+            padded_ends[-1] if len(padded_ends) else 0,
+            pad_id,
+            dtype=input_ids.dtype,
+        )
+        padded_attention_mask = np.zeros_like(
+            padded_input_ids, dtype=attention_mask.dtype
+        )
+        # Position of each token in the padded arrays
+        docs_starts = np.cumsum(docs_lens) - docs_lens
+        tokens_dest = np.arange(len(input_ids)) + np.repeat(
+            padded_starts - docs_starts, docs_lens
+        )
+        padded_input_ids[tokens_dest] = input_ids
+        padded_attention_mask[tokens_dest] = attention_mask
+        return padded_lens, padded_input_ids, padded_attention_mask
+
+    def save_to_disk(self, dirpath: str) -> None:
+        """Save the tokenized docs as .npy files in `dirpath`
+
+        Parameters
+        ----------
+        dirpath : str
+            Directory, created if needed
+        """
+        os.makedirs(dirpath, exist_ok=True)
+        for name in _GPTDATASET_ARRAYS:
+            np.save(
+                os.path.join(dirpath, f"{name}.npy"), getattr(self, f"_{name}")
+            )
+
+    @classmethod
+    def load_from_disk(cls, dirpath: str, mmap: bool = True) -> "GPTDataset":
+        """Load a dataset saved with `save_to_disk`, without re-tokenizing
+
+        Parameters
+        ----------
+        dirpath : str
+            Directory passed to `save_to_disk`
+        mmap : bool
+            Should the arrays be memory-mapped (read-only) rather than read in
+            memory? Pages are then loaded on access, and are shared across
+            DataLoader workers. Default to True.
+
+        Returns
+        -------
+        GPTDataset
+        """
+        dataset = cls.__new__(cls)
+        dataset._load_arrays(dirpath=dirpath, mmap=mmap)
+        return dataset
+
+    def __getitem__(self, idx) -> Union[dict, List[dict]]:
+        """Tokenized doc(s), as views on the underlying arrays"""
+        if isinstance(idx, slice):
+            return self.__getitems__(range(*idx.indices(len(self))))
+        if idx < 0:
+            idx += len(self)
+        start, end = self._offsets[idx], self._offsets[idx + 1]
+        return {
+            "input_ids": self._input_ids[start:end],
+            "attention_mask": self._attention_mask[start:end],
+        }
+
+    def __getitems__(self, indices: List[int]) -> List[dict]:
+        """Tokenized docs at `indices`, as views on the underlying arrays
+
+        Used by torch>=2.0 DataLoaders to fetch a whole batch in one call.
+        """
+        indices = np.array(indices, dtype=np.int64)
+        indices[indices < 0] += len(self)
+        starts = self._offsets[indices].tolist()
+        ends = self._offsets[indices + 1].tolist()
+        return [
+            {
+                "input_ids": self._input_ids[start:end],
+                "attention_mask": self._attention_mask[start:end],
+            }
+            for start, end in zip(starts, ends)
+        ]
 
     def __len__(self):
-        return len(self.tok_data)
+        return len(self._offsets) - 1
 
 
-# TODO : docstr
-def gpttokenizer_collate_fn(dicts_list: List[dict]) -> dict:
+def gpttokenizer_collate_fn(
+    dicts_list: List[dict],
+    pad_token_id: Optional[int] = None,
+    mask_padded_labels: bool = False,
+) -> dict:
     """
     Collate_fn for a list of outputs of GPT2Tokenizer.
 
     To be used as value for the collate_fn argument in torch.data.Datalaoder .
+
+    Docs of different lengths are right-padded to the length of the longest
+    doc of the batch, so that the dataset needs not store padded docs. This
+    requires `pad_token_id`; docs of a GPTDataset built with `padding=True`
+    all have the same length, and need none.
+
+    For training on CUDA, set `pin_memory=True` in the DataLoader: the
+    returned tensors will then be copied to page-locked memory, and batches
+    can be moved to the GPU with `.to(device, non_blocking=True)` so that the
+    copy overlaps with computation.
+
+    Parameters
+    ----------
+    dicts_list : List[dict]
+        Tokenized docs, with keys "input_ids" and "attention_mask"
+    pad_token_id : Optional[int]
+        Id used for padding "input_ids" (typically `tokenizer.pad_token_id`).
+        Other keys are padded with 0. Only required when docs of the batch
+        have different lengths. Use `functools.partial` to set it in a
+        DataLoader. Default to None.
+    mask_padded_labels : bool
+        Should "labels" be set to -100 (ignored by the loss) wherever
+        "attention_mask" is 0? Default to False: "labels" are a copy of
+        "input_ids", pad positions included.
+
+    Returns
+    -------
+    dict
+        Tensors for keys "input_ids", "attention_mask" and "labels", of shape
+        (batch size, length of the longest doc).
     """
     gpttok_dtypes = {
-        "input_ids": torch.long,
-        "labels": torch.long,
-        "attention_mask": torch.float,
+        "input_ids": np.int64,
+        "labels": np.int64,
+        "attention_mask": np.float32,
     }
     # Init
     keys = dicts_list[0].keys()
+    docs_lens = [len(dic["input_ids"]) for dic in dicts_list]
+    max_len = max(docs_lens)
+    if pad_token_id is None and min(docs_lens) != max_len:
+        raise ValueError(
+            "Docs of the batch have different lengths: pass pad_token_id"
+            " to pad them."
+        )
+    batch_shape = (len(dicts_list), max_len)
+    # Fill pre-allocated arrays, then create tensors sharing their memory
     out_dict = dict()
-    # Transform into list of list dict
     for k in keys:
-        out_dict[k] = [dic[k] for dic in dicts_list]
+        pad_value = pad_token_id if k == "input_ids" else 0
+        if pad_value is None:
+            # No padding needed, every cell is filled below
+            array = np.empty(batch_shape, dtype=gpttok_dtypes[k])
+        else:
+            array = np.full(batch_shape, pad_value, dtype=gpttok_dtypes[k])
+        for i, (dic, doc_len) in enumerate(zip(dicts_list, docs_lens)):
+            array[i, :doc_len] = dic[k]
+        out_dict[k] = torch.from_numpy(array)
     # Create labels
-    out_dict["labels"] = copy.deepcopy(out_dict["input_ids"])
-    # Create tensors
-    out_dict = {
-        k: torch.Tensor(v).type(gpttok_dtypes[k]) for k, v in out_dict.items()
-    }
+    labels = out_dict["input_ids"].clone()
+    if mask_padded_labels:
+        labels[out_dict["attention_mask"] == 0] = -100
+    out_dict["labels"] = labels
     return out_dict
 
 
@@ -240,7 +589,7 @@ def splitter(
     test_prop: int,
     train_subsample_prop: float,
     seed: Optional[int],
-) -> List[torch.utils.data.Dataset]:
+) -> List[torch.utils.data.Subset]:
     """Split dataset into train/test/val
 
     The val and test datasets are the same irrespective of the subsamplif of
@@ -262,8 +611,9 @@ def splitter(
 
     Returns
     -------
-    List[torch.utils.data.Dataset]
-        (train dataset, val dataset, test dataset)
+    List[torch.utils.data.Subset]
+        (train dataset, val dataset, test dataset), as views on shuffled
+        indices of `dataset`
     """
     dataset_n = len(dataset)
     # Get sizes
@@ -271,16 +621,16 @@ def splitter(
     test_size = round(test_prop * dataset_n)
     train_size = dataset_n - (val_size + test_size)
     # Shuffle Ids
-    ids = list(range(dataset_n))
-    np.random.seed(seed)
-    np.random.shuffle(ids)
+    ids = np.random.default_rng(seed).permutation(dataset_n)
     # Get ranges
     first_val_idx = train_size
     first_test_idx = first_val_idx + val_size
-    # Subset
-    dataset_train = dataset[:first_val_idx]
-    dataset_val = dataset[first_val_idx:first_test_idx]
-    dataset_test = dataset[first_test_idx:]
+    # Subset, without copying the data
+    dataset_train = torch.utils.data.Subset(dataset, ids[:first_val_idx])
+    dataset_val = torch.utils.data.Subset(
+        dataset, ids[first_val_idx:first_test_idx]
+    )
+    dataset_test = torch.utils.data.Subset(dataset, ids[first_test_idx:])
     # Logging
     logger.info(
         f"Split datasets into train ({len(dataset_train)} rows), val"
@@ -291,7 +641,7 @@ def splitter(
     if train_subsample_prop < 1:
         previous_train_len = len(dataset_train)
         last_train_idx = round(len(dataset_train) * train_subsample_prop)
-        dataset_train = dataset_train[:last_train_idx]
+        dataset_train.indices = dataset_train.indices[:last_train_idx]
         logger.info(
             f"Subsetted the train dataset, keeping only {len(dataset_train)}/"
             f"{previous_train_len} rows ({int(train_subsample_prop*100)}%).)"
@@ -7,7 +7,9 @@ import logging
 import mlflow
 import copy
 import os
-from typing import List, Optional, Union
+import functools
+import itertools
+from typing import List, Optional, Tuple, Union
 
 import generatools.utils.mlflow
 import generatools.utils.transformers
@@ -19,6 +21,11 @@ import generatools.hyperopt
 
 logger = logging.getLogger(__name__)
 
+# torch.inference_mode (torch>=1.9) if available, else torch.no_grad
+_inference_mode = getattr(torch, "inference_mode", torch.no_grad)
+# Default maximum number of sequences per call to model.generate
+_GEN_BATCH_SIZE = 16
+
 
 def gen_seqs_from_prompt(
     prompt: str,
@@ -36,27 +43,206 @@ def gen_seqs_from_prompt(
     Additionnal kwargs are passed to model.generate.
     """
     # Tokenization
-    input_ids = tokenizer.encode(prompt, return_tensors="pt").to(device)
+    input_ids = _encode_prompt(
+        prompt=prompt, tokenizer=tokenizer, device=device
+    )
     input_ids_size = input_ids.shape[1]
     logger.info("-- Prompt of size {}.".format(input_ids_size))
     # Prediction
     transformers.trainer_utils.set_seed(seed)
-    y_seqs = []
-    for i in range(num_return_sequences):
+    outputs = []
+    with _inference_mode():
+        for i in range(num_return_sequences):
+            output = model.generate(
+                input_ids,
+                max_length=input_ids_size + max_length_after_prompt,
+                return_dict_in_generate=False,
+                output_scores=False,
+                do_sample=True,
+                num_return_sequences=1,
+                **kwargs,
+            )
+            outputs.append(output[0])
+    # Decoding, for all sequences at once
+    y_seqs = tokenizer.batch_decode(
+        [output.cpu() for output in outputs], skip_special_tokens=True
+    )
+    return y_seqs
+
+
+def gen_seqs_from_prompts(
+    prompts: List[str],
+    model: transformers.modeling_utils.PreTrainedModel,
+    tokenizer: transformers.tokenization_utils.PreTrainedTokenizerBase,
+    max_length_after_prompt: int,
+    num_return_sequences: int,
+    device: torch.device,
+    seed: Optional[int] = None,
+    batch_size: Optional[int] = _GEN_BATCH_SIZE,
+    **kwargs,
+) -> List[List[str]]:
+    """Generate `num_return_sequences` sequences for each of `prompts`
+
+    Each call to model.generate generates at most `batch_size` sequences.
+    Prompts are thus left-padded into batches of
+    `batch_size` // `num_return_sequences` prompts. If `num_return_sequences`
+    exceeds `batch_size`, the sequences of each prompt are instead split over
+    several calls. Max length for sequences is the length of the longest
+    prompt of the batch + max_length_after_prompt.
+    Additionnal kwargs are passed to model.generate.
+
+    The seed is set once, before the first batch. Seeded outputs thus depend
+    on the prompts and on `batch_size`, and differ from those of
+    `gen_seqs_from_prompt` called on each prompt.
+
+    Parameters
+    ----------
+    batch_size : Optional[int]
+        Maximum number of sequences per call to model.generate, bounding
+        memory use. None for all sequences of all prompts at once.
+
+    Returns
+    -------
+    List[List[str]]
+        For each prompt, its `num_return_sequences` generated sequences
+    """
+    if batch_size is None:
+        batch_size = max(len(prompts), 1) * num_return_sequences
+    transformers.trainer_utils.set_seed(seed)
+    kwargs.setdefault("pad_token_id", _get_pad_token_id(tokenizer=tokenizer))
+    gen_seqs_from_batch = functools.partial(
+        _gen_seqs_from_batch,
+        model=model,
+        tokenizer=tokenizer,
+        max_length_after_prompt=max_length_after_prompt,
+        device=device,
+        **kwargs,
+    )
+    sequences_list = []
+    if num_return_sequences <= batch_size:
+        # Several prompts per call
+        n_prompts = batch_size // num_return_sequences
+        for batch_start in range(0, len(prompts), n_prompts):
+            batch_end = batch_start + n_prompts
+            sequences_list.extend(
+                gen_seqs_from_batch(
+                    prompts=prompts[batch_start:batch_end],
+                    num_return_sequences=num_return_sequences,
+                )
+            )
+        return sequences_list
+    # Several calls per prompt
+    for prompt in prompts:
+        sequences = []
+        for seqs_start in range(0, num_return_sequences, batch_size):
+            n_seqs = min(batch_size, num_return_sequences - seqs_start)
+            sequences.extend(
+                gen_seqs_from_batch(
+                    prompts=[prompt], num_return_sequences=n_seqs
+                )[0]
+            )
+        sequences_list.append(sequences)
+    return sequences_list
+
+
+def _gen_seqs_from_batch(
+    prompts: List[str],
+    model: transformers.modeling_utils.PreTrainedModel,
+    tokenizer: transformers.tokenization_utils.PreTrainedTokenizerBase,
+    max_length_after_prompt: int,
+    num_return_sequences: int,
+    device: torch.device,
+    **kwargs,
+) -> List[List[str]]:
+    """gen_seqs_from_prompts for a single batch, without seeding"""
+    # Tokenization
+    input_ids, attention_mask = _encode_prompts(
+        prompts=tuple(prompts), tokenizer=tokenizer, device=device
+    )
+    input_ids_size = input_ids.shape[1]
+    logger.info(
+        "-- {} prompts of size up to {}.".format(len(prompts), input_ids_size)
+    )
+    # Prediction
+    with _inference_mode():
         output = model.generate(
             input_ids,
+            attention_mask=attention_mask,
             max_length=input_ids_size + max_length_after_prompt,
             return_dict_in_generate=False,
             output_scores=False,
             do_sample=True,
-            num_return_sequences=1,
+            num_return_sequences=num_return_sequences,
             **kwargs,
         )
-        y_seq = [
-            tokenizer.decode(o, skip_special_tokens=True) for o in output
-        ][0]
-        y_seqs.append(y_seq)
-    return y_seqs
+    # Decoding, for all sequences at once. Sequences of a prompt are
+    # contiguous in the output.
+    y_seqs = iter(
+        tokenizer.batch_decode(output.cpu(), skip_special_tokens=True)
+    )
+    return [
+        list(itertools.islice(y_seqs, num_return_sequences)) for _ in prompts
+    ]
+
+
+def _get_pad_token_id(
+    tokenizer: transformers.tokenization_utils.PreTrainedTokenizerBase,
+) -> int:
+    """Padding token id, falling back to the eos token id (as in GPT2)"""
+    if tokenizer.pad_token_id is not None:
+        return tokenizer.pad_token_id
+    return tokenizer.eos_token_id
+
+
+@functools.lru_cache(maxsize=128)
+def _encode_prompts(
+    prompts: Tuple[str, ...],
+    tokenizer: transformers.tokenization_utils.PreTrainedTokenizerBase,
+    device: torch.device,
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Left-padded (input ids, attention mask) of `prompts` on `device`
+
+    Memoized across calls, as `_encode_prompt`.
+    """
+    prompts_ids = [tokenizer.encode(prompt) for prompt in prompts]
+    max_len = max(len(ids) for ids in prompts_ids)
+    input_ids = torch.full(
+        (len(prompts), max_len),
+        _get_pad_token_id(tokenizer=tokenizer),
+        dtype=torch.long,
+    )
+    attention_mask = torch.zeros((len(prompts), max_len), dtype=torch.long)
+    for i, ids in enumerate(prompts_ids):
+        first_idx = max_len - len(ids)
+        input_ids[i, first_idx:] = torch.tensor(ids)
+        attention_mask[i, first_idx:] = 1
+    if device.type == "cuda":
+        input_ids = input_ids.pin_memory()
+        attention_mask = attention_mask.pin_memory()
+    return (
+        input_ids.to(device, non_blocking=True),
+        attention_mask.to(device, non_blocking=True),
+    )
+
+
+@functools.lru_cache(maxsize=128)
+def _encode_prompt(
+    prompt: str,
+    tokenizer: transformers.tokenization_utils.PreTrainedTokenizerBase,
+    device: torch.device,
+) -> torch.Tensor:
+    """Tokenized `prompt` on `device`, memoized across calls
+
+    The same prompt is generated from for each set of sampling parameters, so
+    tokenization and transfer to `device` are done once. The returned tensor
+    is shared between calls, and must not be modified in place.
+
+    On CUDA, the ids are pinned so that the copy to `device` is asynchronous.
+    """
+    input_ids = tokenizer.encode(prompt, return_tensors="pt")
+    if device.type == "cuda":
+        input_ids = input_ids.pin_memory()
+    return input_ids.to(device, non_blocking=True)
 
 
 def run_grid_generation_from_conf(conf: dict):
@@ -80,7 +266,7 @@ def run_grid_generation_from_conf(conf: dict):
         experiment_name=conf["mlflow_expe_name"],
     )
     # Getting param grid
-    param_grid = generatools.hyperopt.generate_grid_from_conf(
+    param_grid = generatools.hyperopt.iter_grid_from_conf(
         conf=conf["hyperparams"]
     )
 
@@ -114,6 +300,9 @@ def run_grid_generation_from_conf(conf: dict):
                     device=device,
                 )
                 loaded_mdl_params = copy.deepcopy(params)
+                # Prompts encoded with the previous tokenizer are outdated
+                _encode_prompt.cache_clear()
+                _encode_prompts.cache_clear()
             else:
                 logger.info("Reusing previously loaded model & tokenizer")
             with mlflow.start_run(experiment_id=experiment_id):
@@ -126,42 +315,52 @@ def run_grid_generation_from_conf(conf: dict):
                 if keywords_new_list == [] or keywords_new_list == [[]]:
                     # If no new list of keywords specified, we will use "None"
                     keywords_new_list = [None]
-                for keywords_new in keywords_new_list:
-                    prompt = generatools.preproc.make_prompt_w_keywords_new(
+                # Markup is bound once, for all keywords_new
+                format_prompt = generatools.preproc.make_prompt_formatter(
+                    ex_sep=params["ex_sep"],
+                    ex_add_numeral=params["ex_add_numeral"],
+                    ex_num_lhs=params["ex_num_lhs"],
+                    ex_num_rhs=params["ex_num_rhs"],
+                    ex_kws_sep=params["ex_kws_sep"],
+                    ex_kws_lhs=params["ex_kws_lhs"],
+                    ex_kws_rhs=params["ex_kws_rhs"],
+                    ex_txts_lhs=params["ex_txts_lhs"],
+                    ex_txts_rhs=params["ex_txts_rhs"],
+                    remove_right_trailing_space=params[
+                        "remove_right_trailing_space"
+                    ],
+                )
+                prompts = [
+                    generatools.preproc.make_prompt_w_keywords_new(
                         intro=params["intro"],
                         kws=params["examples"]["kws"],
                         txts=params["examples"]["txts"],
                         keywords_new=keywords_new,
-                        ex_sep=params["ex_sep"],
-                        ex_add_numeral=params["ex_add_numeral"],
-                        ex_num_lhs=params["ex_num_lhs"],
-                        ex_num_rhs=params["ex_num_rhs"],
-                        ex_kws_sep=params["ex_kws_sep"],
-                        ex_kws_lhs=params["ex_kws_lhs"],
-                        ex_kws_rhs=params["ex_kws_rhs"],
-                        ex_txts_lhs=params["ex_txts_lhs"],
-                        ex_txts_rhs=params["ex_txts_rhs"],
-                        remove_right_trailing_space=params[
-                            "remove_right_trailing_space"
-                        ],
+                        format_prompt=format_prompt,
                     )
+                    for keywords_new in keywords_new_list
+                ]
+                for prompt in prompts:
                     logger.info("Prompt:\n{}".format(prompt))
-                    sequences = generatools.genseqs.gen_seqs_from_prompt(
-                        prompt=prompt,
-                        model=model,
-                        tokenizer=tokenizer,
-                        device=device,
-                        seed=conf["seed"],
-                        max_length_after_prompt=conf[
-                            "max_length_after_prompt"
-                        ],
-                        num_return_sequences=conf["n_seqs"],
-                        # As kwargs
-                        temperature=params["temperature"],
-                        top_p=params["top_p"],
-                        top_k=params["top_k"],
-                        repetition_penalty=params["repetition_penalty"],
-                    )
+                # Generate for all prompts, by batches of prompts
+                sequences_list = generatools.genseqs.gen_seqs_from_prompts(
+                    prompts=prompts,
+                    model=model,
+                    tokenizer=tokenizer,
+                    device=device,
+                    seed=conf["seed"],
+                    max_length_after_prompt=conf["max_length_after_prompt"],
+                    num_return_sequences=conf["n_seqs"],
+                    batch_size=conf.get("gen_batch_size", _GEN_BATCH_SIZE),
+                    # As kwargs
+                    temperature=params["temperature"],
+                    top_p=params["top_p"],
+                    top_k=params["top_k"],
+                    repetition_penalty=params["repetition_penalty"],
+                )
+                for keywords_new, prompt, sequences in zip(
+                    keywords_new_list, prompts, sequences_list
+                ):
                     sequences_trimmed = [
                         generatools.preproc.trim_gen_seq(
                             seq=gen_seq,
@@ -182,7 +381,9 @@ def run_grid_generation_from_conf(conf: dict):
                 # mlflow.log_params(params)
                 # 2/ In a json file, for re-use later (mlflow sucks on that)
                 generatools.utils.mlflow.log_json_artifact(
-                    json_dict=params, filename=conf["mlflow_params_json_name"]
+                    json_dict=params,
+                    filename=conf["mlflow_params_json_name"],
+                    with_fingerprint=True,
                 )
                 # Store output dict as a json artifact
                 dictified_prompt_seqs_pair_list = [  # Passing prompt_seqs_pair to dict for
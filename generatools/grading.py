@@ -1,12 +1,15 @@
 """
 Tools for grading
 """
+import concurrent.futures
 import copy
 import os
+import sys
+import time
 import logging
 import mlflow
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, List, Tuple
 
 import generatools.sequences
 import generatools.utils.text
@@ -39,31 +42,35 @@ class LikertScale:
     items: Dict[int, str]
 
     def get_description(self):
-        concat_items = ", ".join(
-            [str(k) + ": '" + v + "'" for k, v in self.items.items()]
-        )
-        return self.description + "\n" + concat_items
+        """Description followed by the items, computed once at init"""
+        return self._description_w_items
 
     def item_with_check(self, item: int):
         """
         Failsafe. Return the item if belongs to items.keys(), raise a ValueError
         else.
         """
-        items_keys = self.items.keys()
-        if item in items_keys:
+        if item in self._allowed_items:
             return item
-        else:
-            raise ValueError(
-                "Item key '{}' not on the scale ({})".format(item, items_keys)
-            )
+        raise ValueError(
+            f"Item key '{item}' not on the scale ({self._allowed_items_str})"
+        )
 
     def __post_init__(self):
-        """Check 'level' is among expected values"""
+        """Check 'level' is among expected values, and cache items info"""
         allowed_levels = ["sequence", "prompt"]
         if self.level not in allowed_levels:
             raise ValueError(
                 "'level' should be one of {}.".format(allowed_levels)
             )
+        # Scales are not modified after init: build the allowed items and the
+        # description once
+        self._allowed_items = frozenset(self.items)
+        self._allowed_items_str = str(self.items.keys())
+        concat_items = ", ".join(
+            [str(k) + ": '" + v + "'" for k, v in self.items.items()]
+        )
+        self._description_w_items = self.description + "\n" + concat_items
 
 
 class PrintRunAnalysisHeader(object):
@@ -85,36 +92,76 @@ class PrintRunAnalysisHeader(object):
             Generation parameters
         """
         self._clear_screen()
+        params_str = None
+        if params is not None:
+            params_str = self._format_params(params=params)
+        grading_intro = self._build_intro(
+            run_name=run_name, params_str=params_str
+        )
+        print(grading_intro)
+
+    def _build_intro(self, run_name: str = None, params_str: str = None):
+        """Header followed by the formatted parameters"""
         if run_name is not None:
             grading_intro = self._header_w_run_id(run_id=run_name)
         else:
             grading_intro = self._header_wo_run_id(run_id=run_name)
-        if params is not None:
-            grading_intro += "\n"
-            grading_intro += self._format_params(params=params)
-            grading_intro += "\n"
-        print(grading_intro)
+        if params_str is not None:
+            grading_intro += "\n" + params_str + "\n"
+        return grading_intro
 
     def _clear_screen(self):
-        if os.name == "posix":  #  Linux + OSX
-            _ = os.system("clear")
+        """Clear the terminal, without spawning a `clear`/`cls` subprocess"""
+        if os.name == "posix":  # Linux + OSX
+            # Erase display, then move cursor to top-left
+            sys.stdout.write("\x1b[2J\x1b[H")
+            sys.stdout.flush()
         else:  # Windows
-            _ = os.system("cls")
+            self._clear_windows_console()
+
+    def _clear_windows_console(self):
+        """Clear the Windows console as `cls` does, through the console API"""
+        import ctypes
+        import ctypes.wintypes
+
+        class ConsoleScreenBufferInfo(ctypes.Structure):
+            _fields_ = [
+                ("dwSize", ctypes.wintypes._COORD),
+                ("dwCursorPosition", ctypes.wintypes._COORD),
+                ("wAttributes", ctypes.wintypes.WORD),
+                ("srWindow", ctypes.wintypes.SMALL_RECT),
+                ("dwMaximumWindowSize", ctypes.wintypes._COORD),
+            ]
+
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11)  # STD_OUTPUT_HANDLE
+        csbi = ConsoleScreenBufferInfo()
+        if not kernel32.GetConsoleScreenBufferInfo(handle, ctypes.byref(csbi)):
+            # Not a console (e.g. redirected output): nothing to clear
+            return
+        n_cells = csbi.dwSize.X * csbi.dwSize.Y
+        origin = ctypes.wintypes._COORD(0, 0)
+        n_written = ctypes.wintypes.DWORD()
+        kernel32.FillConsoleOutputCharacterA(
+            handle,
+            ctypes.c_char(b" "),
+            n_cells,
+            origin,
+            ctypes.byref(n_written),
+        )
+        kernel32.FillConsoleOutputAttribute(
+            handle, csbi.wAttributes, n_cells, origin, ctypes.byref(n_written)
+        )
+        kernel32.SetConsoleCursorPosition(handle, origin)
 
     def _header_wo_run_id(self, run_id: str = None):
         run_header_str = "RUN ANALYSIS"
         return run_header_str
 
     def _header_w_run_id(self, run_id: str = None):
-        run_header_str = "RUN " + run_id
-        run_header_str = (
-            "=" * len(run_header_str)
-            + "\n"
-            + run_header_str
-            + "\n"
-            + "=" * len(run_header_str)
-        )
-        return run_header_str
+        run_header_str = f"RUN {run_id}"
+        bar = "=" * len(run_header_str)
+        return f"{bar}\n{run_header_str}\n{bar}"
 
     def _format_params(self, params: dict = None):
         params_str = "Parameters: " + str(params)
@@ -161,7 +208,13 @@ class SeqsHandGrading(object):
             (resp seq_lvl_eval) attribute when metric.level is "prompt"
             ("sequence")
         """
-        prompt_seqs_pair = copy.deepcopy(prompt_seqs_pair)
+        # Only the eval dicts are modified by grading: copy them, and share
+        # the (possibly long) sequences with the input pair
+        prompt_seqs_pair = copy.copy(prompt_seqs_pair)
+        prompt_seqs_pair.prompt_lvl_eval = dict(
+            prompt_seqs_pair.prompt_lvl_eval
+        )
+        prompt_seqs_pair.seq_lvl_eval = dict(prompt_seqs_pair.seq_lvl_eval)
         # Grading
         if metric.level == "prompt":
             prompt_seqs_pair_w_grades = self._grading_at_prompt_level(
@@ -189,17 +242,17 @@ class SeqsHandGrading(object):
         print(header)
         for seq_idx in range(n_seqs):
             # Prepare str
-            trimmed_seq_str = "- Trimmed sequence {}/{}: '{}'".format(
-                seq_idx + 1,
-                n_seqs,
-                prompt_seqs_pair.sequences_trimmed[seq_idx],
-            )
-            raw_seq_str = "- Raw sequence {}/{}: '{}'".format(
-                seq_idx + 1, n_seqs, prompt_seqs_pair.sequences[seq_idx]
+            trimmed_seq_str = (
+                f"- Trimmed sequence {seq_idx + 1}/{n_seqs}:"
+                f" '{prompt_seqs_pair.sequences_trimmed[seq_idx]}'"
             )
             # Print and query
             print(trimmed_seq_str)
             if show_raw_seq:
+                raw_seq_str = (
+                    f"- Raw sequence {seq_idx + 1}/{n_seqs}:"
+                    f" '{prompt_seqs_pair.sequences[seq_idx]}'"
+                )
                 print(raw_seq_str)
         scale_desc_str = metric.get_description()
         print("\n" + scale_desc_str)
@@ -243,11 +296,7 @@ class SeqsHandGrading(object):
         Header for grading at the prompt level. Shows the keywords (an empty
         set if no keyword).
         """
-        keyword_header_str = (
-            "\n==== KEYWORD SET {}: ".format(prompt_seqs_pair.keywords)
-            + "===="
-        )
-        return keyword_header_str
+        return f"\n==== KEYWORD SET {prompt_seqs_pair.keywords}: ===="
 
 
 def interactive_grading_from_mlflow_experiment(
@@ -286,9 +335,12 @@ def interactive_grading_from_mlflow_experiment(
         expe_name=conf["mlflow_expe_name"],
     )
 
-    # Get ids of all runs
-    run_ids = generatools.utils.mlflow.get_run_ids(
-        experiment_id=experiment_id, max_results=1000
+    # Get ids of all runs for which the metric is not set yet
+    run_ids = generatools.utils.mlflow.get_run_ids_wo_metric(
+        tracking_uri=conf["mlflow_expe_dirpath"],
+        experiment_id=experiment_id,
+        key=metric.name,
+        max_results=1000,
     )
 
     # Get client
@@ -296,73 +348,80 @@ def interactive_grading_from_mlflow_experiment(
         tracking_uri=conf["mlflow_expe_dirpath"]
     )
 
-    # For each run
-    for run_id in run_ids:
-        # If metric already set, go to next run
-        metric_exists = generatools.utils.mlflow.check_metrics_exist(
-            tracking_uri=conf["mlflow_expe_dirpath"],
-            run_id=run_id,
-            key=metric.name,
-        )
-        if metric_exists:
-            continue
-        # Get sequences
-        prompt_seqs_pair_list = generatools.utils.mlflow.get_json_artifact(
-            run_id=run_id, artifact_name=conf["mlflow_results_json_name"]
-        )
-        prompt_seqs_pair_list = [
-            generatools.sequences.PromptSeqsPair(**prompt_seqs_pair)
-            for prompt_seqs_pair in prompt_seqs_pair_list
-        ]
-        # Get parameters
-        params = generatools.utils.mlflow.get_json_artifact(
-            run_id=run_id, artifact_name=conf["mlflow_params_json_name"]
-        )
-        # Print header for this run
-        generatools.grading.PrintRunAnalysisHeader()(
-            run_name=run_id, params=params
-        )
-        # Associate grade to sequences
-        for seq_idx in range(len(prompt_seqs_pair_list)):
-            # Add grade to sequences
-            prompt_seqs_pair = prompt_seqs_pair_list[seq_idx]
-            grader = generatools.grading.SeqsHandGrading().interactive_grading
-            prompt_seqs_pair = grader(
-                prompt_seqs_pair=prompt_seqs_pair,
-                metric=metric,
-                show_raw_seq=False,
+    # Header printer and grader, shared by all runs
+    print_run_analysis_header = PrintRunAnalysisHeader()
+    grader = SeqsHandGrading().interactive_grading
+
+    # For each run. Artifacts of the next run are fetched in the background
+    # while the current run is being graded.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        if run_ids:
+            next_run_artifacts = executor.submit(
+                _get_run_artifacts, run_id=run_ids[0], conf=conf
             )
-            prompt_seqs_pair_list[seq_idx] = prompt_seqs_pair
-        prompt_seqs_pair_list = generatools.sequences.PromptSeqsPairsList(
-            prompt_seqs_pair_list
-        )
-        # Calculate overall metrics
-        if metric.level == "prompt":
-            metrics = prompt_seqs_pair_list.average_prompt_lvl_metrics()
-        elif metric.level == "sequence":
-            metrics = prompt_seqs_pair_list.average_seq_lvl_metrics()
-        # Log metrics
-        for metric_name, metric_val in metrics.items():
-            client.log_metric(
+        for run_idx, run_id in enumerate(run_ids):
+            # Get sequences and parameters
+            prompt_seqs_pair_list, params = next_run_artifacts.result()
+            if run_idx + 1 < len(run_ids):
+                next_run_artifacts = executor.submit(
+                    _get_run_artifacts, run_id=run_ids[run_idx + 1], conf=conf
+                )
+            # Print header for this run
+            print_run_analysis_header(run_name=run_id, params=params)
+            # Associate grade to sequences
+            for seq_idx in range(len(prompt_seqs_pair_list)):
+                # Add grade to sequences
+                prompt_seqs_pair = prompt_seqs_pair_list[seq_idx]
+                prompt_seqs_pair = grader(
+                    prompt_seqs_pair=prompt_seqs_pair,
+                    metric=metric,
+                    show_raw_seq=False,
+                )
+                prompt_seqs_pair_list[seq_idx] = prompt_seqs_pair
+            prompt_seqs_pair_list = generatools.sequences.PromptSeqsPairsList(
+                prompt_seqs_pair_list
+            )
+            # Calculate overall metrics
+            if metric.level == "prompt":
+                metrics = prompt_seqs_pair_list.average_prompt_lvl_metrics()
+            elif metric.level == "sequence":
+                metrics = prompt_seqs_pair_list.average_seq_lvl_metrics()
+            # Log metrics, in a single call
+            timestamp = int(time.time() * 1000)
+            client.log_batch(
                 run_id=run_id,
-                key=metric_name,
-                value=metric_val,
+                metrics=[
+                    mlflow.entities.Metric(
+                        key=metric_name,
+                        value=metric_val,
+                        timestamp=timestamp,
+                        step=0,
+                    )
+                    for metric_name, metric_val in metrics.items()
+                ],
             )
-        # Save grade with sequences
-        # 1/ Remove previous dict
-        run = client.get_run(run_id)
-        dict_path = os.path.join(
-            run.info.artifact_uri, conf["mlflow_results_json_name"]
-        )
-        try:  # Works only if there is something to remove
-            os.remove(dict_path)
-            logger.debug("Removed previously existing {}".format(dict_path))
-        except Exception:
-            pass
-        # 2/ Use new dict
-        prompt_seqs_pair_list_json = prompt_seqs_pair_list.to_json()
-        client.log_dict(
-            run_id=run_id,
-            dictionary=prompt_seqs_pair_list_json,
-            artifact_file=conf["mlflow_results_json_name"],
-        )
+            # Save grade with sequences. log_dict replaces the previous dict.
+            prompt_seqs_pair_list_json = prompt_seqs_pair_list.to_json()
+            client.log_dict(
+                run_id=run_id,
+                dictionary=prompt_seqs_pair_list_json,
+                artifact_file=conf["mlflow_results_json_name"],
+            )
+            generatools.utils.mlflow.clear_caches()
+
+
+def _get_run_artifacts(
+    run_id: str, conf: dict
+) -> Tuple[List[generatools.sequences.PromptSeqsPair], dict]:
+    """(generated sequences, generation parameters) stored for a run"""
+    prompt_seqs_pair_list = generatools.utils.mlflow.get_json_artifact(
+        run_id=run_id, artifact_name=conf["mlflow_results_json_name"]
+    )
+    prompt_seqs_pair_list = [
+        generatools.sequences.PromptSeqsPair(**prompt_seqs_pair)
+        for prompt_seqs_pair in prompt_seqs_pair_list
+    ]
+    params = generatools.utils.mlflow.get_json_artifact(
+        run_id=run_id, artifact_name=conf["mlflow_params_json_name"]
+    )
+    return prompt_seqs_pair_list, params
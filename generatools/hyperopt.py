@@ -1,8 +1,10 @@
 """
 Hyperoptimization
 """
+import collections.abc
+import itertools
 import sklearn.model_selection
-from typing import Dict
+from typing import Dict, Iterator
 
 
 def generate_grid_from_conf(
@@ -14,3 +16,39 @@ def generate_grid_from_conf(
     """
     grid = sklearn.model_selection.ParameterGrid(param_grid=conf)
     return grid
+
+
+def iter_grid_from_conf(conf: Dict[str, list]) -> Iterator[dict]:
+    """
+    Iterate over the parameter grid based on a dictionnary containing list of
+    possible values for each key, one set of parameters at a time.
+
+    Yields the same sets of parameters, in the same order, as
+    `generate_grid_from_conf`, without ever materializing the grid. Values must
+    be non-empty lists (or iterables other than strings), as for
+    ParameterGrid: conf is checked when calling, before iterating.
+    """
+    keys = sorted(conf)
+    for key in keys:
+        _check_grid_values(key=key, values=conf[key])
+    return (
+        dict(zip(keys, values))
+        for values in itertools.product(*(conf[key] for key in keys))
+    )
+
+
+def _check_grid_values(key: str, values) -> None:
+    """Raise as ParameterGrid on values that are not a non-empty list"""
+    if isinstance(values, (str, bytes)) or not isinstance(
+        values, collections.abc.Iterable
+    ):
+        raise TypeError(
+            f"Parameter grid for parameter '{key}' needs to be a list, but"
+            f" got {values!r} (of type {type(values).__name__}) instead."
+            " Single values need to be wrapped in a list with one element."
+        )
+    if isinstance(values, collections.abc.Sized) and len(values) == 0:
+        raise ValueError(
+            f"Parameter grid for parameter '{key}' need to be a non-empty"
+            f" sequence, got: {values!r}"
+        )
@@ -1,8 +1,7 @@
 """
 Text preprocessing
 """
-import copy
-from typing import List, Optional
+from typing import Callable, List, Optional
 
 
 def prompt_formatter(
@@ -29,6 +28,9 @@ def prompt_formatter(
     If both are specified, kws should be one element longer than txts (see
     example)
 
+    For formatting many prompts with the same markup, see
+    `make_prompt_formatter`.
+
     Parameters
     ----------
     intro : str
@@ -85,54 +87,107 @@ def prompt_formatter(
     ... )
     'Generate sentences with keywords.\n1. Keywords: "table, yellow" Sentence: "The table is yellow."\n2. Keywords: "car, blue" Sentence: "The car is blue."\n3. Keywords: "house, red" Sentence: "'
     """
-    # Sanity on lengths of kws & ex (kws should be one longer than txts)
-    if (kws is not None) and (txts is not None):
-        if len(kws) != len(txts) + 1:
-            raise ValueError(
-                "kws should be one element longer than txts"
-                f" (len of kws: {len(kws)}, of txt: {len(txts)})"
+    format_prompt = make_prompt_formatter(
+        ex_sep=ex_sep,
+        ex_add_numeral=ex_add_numeral,
+        ex_num_lhs=ex_num_lhs,
+        ex_num_rhs=ex_num_rhs,
+        ex_kws_lhs=ex_kws_lhs,
+        ex_kws_sep=ex_kws_sep,
+        ex_kws_rhs=ex_kws_rhs,
+        ex_txts_lhs=ex_txts_lhs,
+        ex_txts_rhs=ex_txts_rhs,
+        remove_right_trailing_space=remove_right_trailing_space,
+    )
+    prompt = format_prompt(intro=intro, kws=kws, txts=txts)
+    return prompt
+
+
+def make_prompt_formatter(
+    ex_sep: str = "",
+    ex_add_numeral: bool = False,
+    ex_num_lhs: str = "",
+    ex_num_rhs: str = "",
+    ex_kws_lhs: str = "",
+    ex_kws_sep: str = "",
+    ex_kws_rhs: str = "",
+    ex_txts_lhs: str = "",
+    ex_txts_rhs: str = "",
+    remove_right_trailing_space: bool = False,
+) -> Callable[..., str]:
+    """Bind the prompt markup once, for formatting many prompts
+
+    Parameters are those of `prompt_formatter`, except for the content (intro,
+    kws and txts), which is passed to the returned function.
+
+    Returns
+    -------
+    Callable[..., str]
+        format_prompt(intro="", kws=None, txts=None) -> str, equivalent to
+        `prompt_formatter` with the bound markup.
+    """
+    kws_rhs_txts_lhs = ex_kws_rhs + ex_txts_lhs
+
+    def format_prompt(
+        intro: str = "",
+        kws: Optional[List[List[str]]] = None,
+        txts: Optional[List[str]] = None,
+    ) -> str:
+        # Sanity on lengths of kws & ex (kws should be one longer than txts)
+        if (kws is not None) and (txts is not None):
+            if len(kws) != len(txts) + 1:
+                raise ValueError(
+                    "kws should be one element longer than txts"
+                    f" (len of kws: {len(kws)}, of txt: {len(txts)})"
+                )
+        # Sanity: all elements of kws should be list
+        if kws is not None:
+            if not all(isinstance(kw, list) for kw in kws):
+                raise ValueError("All elements in kw should be lists")
+        # Create list of examples. The last one is left open for generation.
+        if (kws is not None) and (txts is not None):
+            examples_list = [
+                f"{ex_kws_lhs}{ex_kws_sep.join(kw)}{kws_rhs_txts_lhs}"
+                f"{txt}{ex_txts_rhs}"
+                for kw, txt in zip(kws, txts)
+            ]
+            examples_list.append(
+                f"{ex_kws_lhs}{ex_kws_sep.join(kws[-1])}{kws_rhs_txts_lhs}"
             )
-    # kws
-    examples = ""
-    if kws is not None:
-        # Sanity: all elements should be list
-        if not all([isinstance(kw, list) for kw in kws]):
-            raise ValueError("All elements in kw should be lists")
-        kws_w_lhs_rhs_sep = [
-            ex_kws_lhs + ex_kws_sep.join(kw) + ex_kws_rhs for kw in kws
-        ]
-    # txts
-    if txts is not None:
-        txts_w_lhs_rhs = [ex_txts_lhs + txt + ex_txts_rhs for txt in txts]
-    # Create list of examples - both kws & txts
-    if (kws is not None) and (txts is not None):
-        examples_list = []
-        for i in range(len(txts)):
-            examples_list.append(kws_w_lhs_rhs_sep[i] + txts_w_lhs_rhs[i])
-        examples_list.append(kws_w_lhs_rhs_sep[-1] + ex_txts_lhs)
-    # Create list of examples - only kws
-    elif (kws is not None) and (txts is None):
-        examples_list = kws_w_lhs_rhs_sep
-        examples_list.append(ex_kws_lhs)
-    # Create list of examples - only txts
-    elif (txts is not None) and (kws is None):
-        examples_list = txts_w_lhs_rhs
-        examples_list.append(ex_txts_lhs)
-    # Create list of examples - None (empty list)
-    elif (kws is None) and (txts is None):
-        examples_list = []  # Numerals
-    if ex_add_numeral and len(examples_list) != 0:
-        for i in range(len(examples_list)):
-            examples_list[i] = (
-                ex_num_lhs + str(i + 1) + ex_num_rhs + examples_list[i]
+        elif kws is not None:
+            examples_list = [
+                f"{ex_kws_lhs}{ex_kws_sep.join(kw)}{ex_kws_rhs}" for kw in kws
+            ]
+            examples_list.append(ex_kws_lhs)
+        elif txts is not None:
+            examples_list = [
+                f"{ex_txts_lhs}{txt}{ex_txts_rhs}" for txt in txts
+            ]
+            examples_list.append(ex_txts_lhs)
+        else:
+            examples_list = []
+        # Remove trailing right space from the open example, unless it is blank
+        # (then the whole prompt is stripped, as spaces may precede it)
+        rstrip_prompt = remove_right_trailing_space
+        if rstrip_prompt and examples_list:
+            open_example = examples_list[-1].rstrip(" ")
+            if open_example:
+                examples_list[-1] = open_example
+                rstrip_prompt = False
+        # Assemblage, with numerals if needed
+        if ex_add_numeral:
+            examples = ex_sep.join(
+                f"{ex_num_lhs}{i}{ex_num_rhs}{example}"
+                for i, example in enumerate(examples_list, start=1)
             )
-    # Assemblage
-    examples = ex_sep.join(examples_list)
-    prompt = intro + examples
-    # Remove trailing right space
-    if remove_right_trailing_space:
-        prompt = prompt.rstrip(" ")
-    return prompt
+        else:
+            examples = ex_sep.join(examples_list)
+        prompt = intro + examples
+        if rstrip_prompt:
+            prompt = prompt.rstrip(" ")
+        return prompt
+
+    return format_prompt
 
 
 def make_prompt_w_keywords_new(
@@ -140,6 +195,7 @@ def make_prompt_w_keywords_new(
     kws: Optional[List[List[str]]] = None,
     txts: Optional[List[str]] = None,
     keywords_new: Optional[List[str]] = None,
+    format_prompt: Optional[Callable[..., str]] = None,
     **kwargs,
 ) -> str:
     """Make prompt with kws and txts, ,using additional keywords
@@ -148,6 +204,10 @@ def make_prompt_w_keywords_new(
     essentially does kws += keywords_new, plus sanity checks,
     before passing these all to `prompt_formatter`.
 
+    When making prompts for many `keywords_new` with the same markup, pass
+    `format_prompt`, returned by `make_prompt_formatter`, instead of the
+    markup as kwargs.
+
     See the documentation for `prompt_formatter` for more.
     """
     if (kws is None) != (keywords_new is None):
@@ -155,16 +215,17 @@ def make_prompt_w_keywords_new(
             "Either kws and keywords_new are both specified,"
             " or both are set to None"
         )
+    if format_prompt is not None and kwargs:
+        raise ValueError(
+            "The markup is bound in format_prompt, and cannot be passed as"
+            " kwargs as well"
+        )
     if kws is not None:
-        kws = copy.deepcopy(kws)
-        kws.append(keywords_new)
-    prompt = prompt_formatter(
-        intro=intro,
-        kws=kws,
-        txts=txts,
-        **kwargs,
-    )
-    return prompt
+        # New list, so that the caller's kws is left untouched
+        kws = [*kws, keywords_new]
+    if format_prompt is None:
+        return prompt_formatter(intro=intro, kws=kws, txts=txts, **kwargs)
+    return format_prompt(intro=intro, kws=kws, txts=txts)
 
 
 def trim_gen_seq(seq: str, prompt: str, end_delimiter: str) -> str:
@@ -172,7 +233,7 @@ def trim_gen_seq(seq: str, prompt: str, end_delimiter: str) -> str:
     Extract generated sequence
 
     Two steps:
-    1. Remove `prompt` (replaced by "")
+    1. Remove `prompt` (the prefix of `seq`)
     2. Drop everything on the right of `end_delimiter`
     """
     seq = _left_trim_gen_seq(seq=seq, prompt=prompt)
@@ -183,7 +244,13 @@ def trim_gen_seq(seq: str, prompt: str, end_delimiter: str) -> str:
 def _left_trim_gen_seq(seq: str, prompt: str) -> str:
     """
     Drop the prompt from the generated sequence.
+
+    Generated sequences start with their prompt, which is then sliced off.
+    Otherwise, occurrences of the prompt are removed wherever they are.
     """
+    if seq.startswith(prompt):
+        prompt_len = len(prompt)
+        return seq[prompt_len:]
     seq = seq.replace(prompt, "")
     return seq
 
@@ -192,5 +259,5 @@ def _right_trim_gen_seq(seq: str, end_delimiter: str):
     """
     Remove anything on the rhs of `end_delimiter`
     """
-    seq = seq.split(end_delimiter)[0]
+    seq = seq.partition(end_delimiter)[0]
     return seq
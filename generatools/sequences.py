@@ -1,14 +1,33 @@
 """
 Storage for generated sequences, together with their prompts, metrics etc.
 """
+import itertools
+import json
 import statistics
-from dataclasses import dataclass, field
-from typing import List, Dict, Union, Optional
+import numpy as np
+from typing import BinaryIO, List, Dict, Union, Optional
 from numbers import Number
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-@dataclass
-class PromptSeqsPair:
+
+def _mean(xs: List[Number]) -> float:
+    """Arithmetic mean, without statistics.mean's exact Fraction arithmetic
+
+    Raises statistics.StatisticsError on empty input, as statistics.mean.
+    """
+    n = len(xs)
+    if n == 0:
+        raise statistics.StatisticsError(
+            "mean requires at least one data point"
+        )
+    return float(xs[0]) if n == 1 else sum(xs) / n
+
+
+class PromptSeqsPair(object):
     """
     Store pairs of (sequence seed, list of sequence endings), together with
     their evaluation.
@@ -23,35 +42,65 @@ class PromptSeqsPair:
 
     We can also associate to each sequence a set of eval (seq_lvl_eval).
     seq_lvl_eval is then a dict of eval_name: [metric_seq1, metric_seq2, ...].
+    Evals left to None are stored as empty dicts.
 
     Use check_attributes_sanity() to make sure all attributes are consistent in
     length and types (done automatically at init, but not afterward.)
     """
 
-    prompt: str
-    sequences: List[str]
-    keywords: Optional[list] = None
-    sequences_trimmed: Union[List[str], None] = None
-    prompt_lvl_eval: Dict[str, Number] = field(default_factory=dict)
-    seq_lvl_eval: Dict[str, List[Number]] = field(default_factory=dict)
+    __slots__ = (
+        "prompt",
+        "sequences",
+        "keywords",
+        "sequences_trimmed",
+        "prompt_lvl_eval",
+        "seq_lvl_eval",
+    )
+
+    def __init__(
+        self,
+        prompt: str,
+        sequences: List[str],
+        keywords: Optional[list] = None,
+        sequences_trimmed: Union[List[str], None] = None,
+        prompt_lvl_eval: Optional[Dict[str, Number]] = None,
+        seq_lvl_eval: Optional[Dict[str, List[Number]]] = None,
+    ):
+        self.prompt = prompt
+        self.sequences = sequences
+        self.keywords = keywords
+        self.sequences_trimmed = sequences_trimmed
+        self.prompt_lvl_eval = (
+            {} if prompt_lvl_eval is None else prompt_lvl_eval
+        )
+        self.seq_lvl_eval = {} if seq_lvl_eval is None else seq_lvl_eval
+        self.check_attributes_sanity()
+
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return all(
+            getattr(self, attr) == getattr(other, attr)
+            for attr in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        attrs = ", ".join(
+            f"{attr}={getattr(self, attr)!r}" for attr in self.__slots__
+        )
+        return f"{self.__class__.__name__}({attrs})"
 
     def to_dict(self) -> dict:
         """Transform object to dict"""
-        return self.__dict__
+        return {attr: getattr(self, attr) for attr in self.__slots__}
 
     def average_seq_lvl_eval(self) -> dict:
         """For each metric, return its average value across sequences"""
-        if self.seq_lvl_eval is None:
-            raise ValueError("Cannot average 'seq_lvl_eval' when None.")
         mean_dict = {}
         for metric_name, metric_values in self.seq_lvl_eval.items():
-            metric_mean = statistics.mean(self.seq_lvl_eval[metric_name])
-            mean_dict[metric_name] = metric_mean
+            mean_dict[metric_name] = _mean(metric_values)
         return mean_dict
 
-    def __post_init__(self):
-        self.check_attributes_sanity()
-
     def check_attributes_sanity(self):
         """Check arguments consistency.
 
@@ -59,28 +108,29 @@ class PromptSeqsPair:
         - sequences and sequences_trimmed have same lenght (if specified)
         - Check prompt_lvl_eval and seq_lvl_eval types and lengths (if specified)
         """
+        n_seqs = len(self.sequences)
         if self.sequences_trimmed is not None:
-            if len(self.sequences_trimmed) != len(self.sequences):
+            if len(self.sequences_trimmed) != n_seqs:
                 raise ValueError(
                     "Lengths of sequences and sequences_trimmed differ."
                 )
         # Check prompt_lvl_eval:
-        if len(self.prompt_lvl_eval) != 0:
+        if self.prompt_lvl_eval:
             if not isinstance(self.prompt_lvl_eval, dict):
                 raise TypeError("prompt_lvl_eval should be a dict")
-            for metric_name, metric in self.prompt_lvl_eval.items():
+            for metric in self.prompt_lvl_eval.values():
                 if not isinstance(metric, Number):
                     raise TypeError(
                         "values in prompt_lvl_eval should be a numbers.Number"
                     )
         # Check seq_lvl_eval
-        if len(self.seq_lvl_eval) != 0:
+        if self.seq_lvl_eval:
             if not isinstance(self.seq_lvl_eval, dict):
                 raise TypeError("prompt_lvl_eval should be a dict")
-            for metric_name, metric in self.seq_lvl_eval.items():
+            for metric in self.seq_lvl_eval.values():
                 if not isinstance(metric, list):
                     raise TypeError("values in seq_lvl_eval should be a list")
-                if len(metric) != len(self.sequences):
+                if len(metric) != n_seqs:
                     raise ValueError(
                         "values in seq_lvl_eval should be have same length as sequences"
                     )
@@ -95,20 +145,23 @@ class PromptSeqsPairsList(object):
     - average_seq_lvl_metrics: to average metrics at the prompt level
     """
 
+    __slots__ = ("_list",)
+
     def __init__(self, ls: List[PromptSeqsPair]):
         self._list = ls
         self._check_all_are_prompt_seqs_pair(ls=self._list)
 
     def _check_all_are_prompt_seqs_pair(self, ls):
-        for prompt_seqs_pair in ls:
-            if not isinstance(prompt_seqs_pair, PromptSeqsPair):
-                raise ValueError("All elements in ls should be PromptSeqsPair")
+        if not all(isinstance(pair, PromptSeqsPair) for pair in ls):
+            raise ValueError("All elements in ls should be PromptSeqsPair")
 
     def _check_shared_metrics_names(self, ls, lvl):
         """lvl is one of 'prompt_lvl_eval', 'seq_lvl_eval'"""
         metrics_names = getattr(self._list[0], lvl).keys()
-        for i in range(1, len(self._list)):
-            if getattr(self._list[i], lvl).keys() != metrics_names:
+        pairs = iter(self._list)
+        next(pairs)
+        for prompt_seqs_pair in pairs:
+            if getattr(prompt_seqs_pair, lvl).keys() != metrics_names:
                 raise KeyError(
                     "Not all PromptSeqsPair in this list have the same metrics listed"
                 )
@@ -126,35 +179,98 @@ class PromptSeqsPairsList(object):
         ]
         return out_json
 
+    def to_json_bytes(self, fp: Optional[BinaryIO] = None) -> bytes:
+        """
+        Serialize the list of prompt_seqs_pair to utf-8 json
+
+        Uses orjson if installed, else json. If `fp` is given, the json is also
+        written to it, in a single call.
+
+        Note orjson writes NaN as null, where json writes NaN.
+        """
+        out_json = self.to_json()
+        if orjson is not None:
+            json_bytes = orjson.dumps(out_json)
+        else:
+            json_bytes = json.dumps(out_json, ensure_ascii=False).encode(
+                "utf-8"
+            )
+        if fp is not None:
+            fp.write(json_bytes)
+        return json_bytes
+
     def average_prompt_lvl_metrics(
         self,
     ) -> dict:
         """Average prompt level metrics across all pairs"""
-        metric_averages = {}
         self._check_shared_metrics_names(ls=self._list, lvl="prompt_lvl_eval")
-        metrics_names = self._list[0].prompt_lvl_eval.keys()
-        for metric_name in metrics_names:
-            metric_values = [
-                self._list[i].prompt_lvl_eval[metric_name]
-                for i in range(len(self._list))
-            ]
-            avg_metric = statistics.mean(metric_values)
-            metric_averages[metric_name] = avg_metric
+        metric_sums = dict.fromkeys(self._list[0].prompt_lvl_eval, 0)
+        for prompt_seqs_pair in self._list:
+            pair_evals = prompt_seqs_pair.prompt_lvl_eval
+            for metric_name, metric in pair_evals.items():
+                metric_sums[metric_name] += metric
+        n_pairs = len(self._list)
+        metric_averages = {
+            metric_name: metric_sum / n_pairs
+            for metric_name, metric_sum in metric_sums.items()
+        }
         return metric_averages
 
     def average_seq_lvl_metrics(self) -> dict:
-        """Average prompt level metrics across all pairs"""
-        metric_averages = {}
+        """Average sequence level metrics across all pairs
+
+        Sequence level metrics are first averaged within each pair, so that
+        all pairs weigh the same.
+        """
         self._check_shared_metrics_names(ls=self._list, lvl="seq_lvl_eval")
-        metrics_list = [
-            prompt_seqs_pair.average_seq_lvl_eval()
-            for prompt_seqs_pair in self._list
-        ]
-        metrics_names = metrics_list[0].keys()
-        for metric_name in metrics_names:
-            metric_values = [
-                metrics_list[i][metric_name] for i in range(len(self._list))
+        metrics_names = list(self._list[0].seq_lvl_eval)
+        if not metrics_names:
+            return {}
+        # If all pairs have as many sequences, reduce in a single numpy call
+        try:
+            metric_values = np.asarray(
+                [
+                    [pair.seq_lvl_eval[name] for name in metrics_names]
+                    for pair in self._list
+                ],
+                dtype=np.float64,
+            )
+        except ValueError:
+            return self._average_ragged_seq_lvl_metrics()
+        if metric_values.shape[2] == 0:
+            raise statistics.StatisticsError(
+                "Cannot average sequence level metrics over no sequences"
+            )
+        metric_means = metric_values.mean(axis=(0, 2))
+        metric_averages = dict(zip(metrics_names, metric_means.tolist()))
+        return metric_averages
+
+    def _average_ragged_seq_lvl_metrics(self) -> dict:
+        """average_seq_lvl_metrics, for pairs with various numbers of seqs
+
+        Each metric is flattened into a single buffer, whose per pair segments
+        (given by their offsets) are summed in one np.add.reduceat call.
+        """
+        metric_averages = {}
+        for metric_name in self._list[0].seq_lvl_eval:
+            pairs_values = [
+                pair.seq_lvl_eval[metric_name] for pair in self._list
             ]
-            metric_mean = statistics.mean(metric_values)
-            metric_averages[metric_name] = metric_mean
+            lengths = np.fromiter(
+                (len(values) for values in pairs_values),
+                dtype=np.int64,
+                count=len(pairs_values),
+            )
+            if not lengths.all():
+                raise statistics.StatisticsError(
+                    f"Cannot average '{metric_name}' over no sequences"
+                )
+            flat = np.fromiter(
+                itertools.chain.from_iterable(pairs_values),
+                dtype=np.float64,
+                count=int(lengths.sum()),
+            )
+            offsets = np.cumsum(lengths) - lengths
+            pair_means = np.add.reduceat(flat, offsets) / lengths
+            metric_averages[metric_name] = float(pair_means.mean())
         return metric_averages
@@ -6,17 +6,47 @@ mflow.set_experiment() have been called beforehand to set the dir where all
 expe are stored, and the expe itself. Note that some utilities will still
 require to pass the experiment name/id or the tracking_uri.
 """
+import collections.abc
+import concurrent.futures
+import functools
+import hashlib
 import mlflow
-import tempfile
 import os
 import inspect
 import json
-import pandas as pd
 import logging
-from typing import Union, Dict
+from typing import Union, Dict, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+_FINGERPRINT_SUFFIX = ".sha256"
+# (tracking_uri, run_id, key) known to be logged, for check_metrics_exist
+_found_metrics = set()
+# (tracking_uri, expe_name): experiment id, for get_expe_id
+_expe_ids = {}
+# (tracking_uri, run_id): params of finished runs, for get_run_params
+_finished_runs_params = {}
+
+
+def clear_caches() -> None:
+    """Clear the lookups cached by this module
+
+    Needed only after changes made by other means than this module: deleted
+    runs or experiments, artifacts overwritten otherwise than through
+    `create_artifact_from_str`, or reloaded modules whose functions are logged
+    as params.
+    """
+    _expe_ids.clear()
+    _found_metrics.clear()
+    _finished_runs_params.clear()
+    _read_artifact.cache_clear()
+    _getsource.cache_clear()
+
 
 def create_expe(expe_name: str) -> str:
     """Create expe if does not exist, and return its id.
@@ -47,15 +77,15 @@ def create_artifact_from_str(s: str, filename: str) -> None:
 
     The artifact name in MLflow will be `filename`.
     """
-    with tempfile.TemporaryDirectory() as directory:
-        artifact_tmp_path = os.path.join(directory, filename)
-        with open(artifact_tmp_path, "w") as f:
-            f.write(s)
-        mlflow.log_artifact(artifact_tmp_path)
+    mlflow.log_text(text=s, artifact_file=filename)
+    _read_artifact.cache_clear()
 
 
 def run_w_params_exists(
-    params: dict, experiment_id: str, params_artifact_name: str
+    params: dict,
+    experiment_id: str,
+    params_artifact_name: str,
+    max_workers: int = 16,
 ) -> bool:
     """Any previous run with given parameters?
 
@@ -63,7 +93,12 @@ def run_w_params_exists(
     status "FINISHED" in experiment `experiment_id`.
 
     Note this is done wrt to parameters stored by the user as json
-    in `params_artifact_name`.
+    in `params_artifact_name`. Artifacts are fetched concurrently, and the
+    search stops at the first match.
+
+    For runs where the params were logged with `with_fingerprint=True`, only
+    the fingerprint is fetched, and compared with that of `params`. Matching
+    is thus wrt the canonical json of the parameters.
 
     Parameters
     ----------
@@ -73,15 +108,55 @@ def run_w_params_exists(
     experiment_id : dict
         experiment_id
 
+    max_workers: int
+        Number of threads fetching params artifacts concurrently
+
     Returns
     -------
     bool
     """
-    all_runs_params = get_json_artifact_for_all_runs(
-        experiment_id=experiment_id, artifact_name=params_artifact_name
+    run_ids = get_run_ids(experiment_id=experiment_id, max_results=1000000)
+    params_match = functools.partial(
+        _run_params_match,
+        params=params,
+        fingerprint=_json_fingerprint(json_dict=params),
+        params_artifact_name=params_artifact_name,
     )
-    similar_run_found = any([params == p for p in all_runs_params.values()])
-    return similar_run_found
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers
+    ) as executor:
+        futures = [executor.submit(params_match, run_id) for run_id in run_ids]
+        for future in concurrent.futures.as_completed(futures):
+            if future.result():
+                # Unstarted fetches are dropped, running ones are awaited
+                for other_future in futures:
+                    other_future.cancel()
+                return True
+    return False
+
+
+def _run_params_match(
+    run_id: str,
+    params: dict,
+    fingerprint: Optional[str],
+    params_artifact_name: str,
+) -> bool:
+    """Compare fingerprints if logged for `run_id`, else the full params"""
+    if fingerprint is not None:
+        try:
+            run_fingerprint = _read_artifact(
+                tracking_uri=mlflow.get_tracking_uri(),
+                run_id=run_id,
+                artifact_name=params_artifact_name + _FINGERPRINT_SUFFIX,
+            )
+        except FileNotFoundError:
+            pass
+        else:
+            return run_fingerprint == fingerprint
+    run_params = get_json_artifact(
+        run_id=run_id, artifact_name=params_artifact_name
+    )
+    return run_params == params
 
 
 def get_expe_id(expe_name: str) -> Union[str, None]:
@@ -96,13 +171,20 @@ def get_expe_id(expe_name: str) -> Union[str, None]:
     -------
     Union[str, None]
         str of id experiment if exists, otherwise None.
+
+    Notes
+    -----
+    Found ids are cached per tracking uri. Missing experiments are looked up
+    anew at each call, so that experiments created by other means are seen.
     """
+    cache_key = (mlflow.get_tracking_uri(), expe_name)
+    if cache_key in _expe_ids:
+        return _expe_ids[cache_key]
     experiment = mlflow.get_experiment_by_name(expe_name)
-    if experiment is not None:
-        experiment_id = experiment.experiment_id
-    else:
-        experiment_id = None
-    return experiment_id
+    if experiment is None:
+        return None
+    _expe_ids[cache_key] = experiment.experiment_id
+    return experiment.experiment_id
 
 
 def dict_to_mlflow_params(dic: dict, concat_sep: str = "__") -> dict:
@@ -123,13 +205,62 @@ def dict_to_mlflow_params(dic: dict, concat_sep: str = "__") -> dict:
     -------
     dict
     """
-    out_dic = pd.io.json._normalize.nested_to_record(ds=dic, sep=concat_sep)
-    for k, v in out_dic.items():
-        if callable(v):
-            out_dic[k] = inspect.getsource(v)
+    out_dic = _flatten_dict(dic=dic, concat_sep=concat_sep)
+    return out_dic
+
+
+def _flatten_dict(dic: dict, concat_sep: str) -> dict:
+    """Collapse nested dicts, joining keys with `concat_sep`
+
+    As pandas' nested_to_record: collapsed keys are str, and empty nested
+    dicts are dropped. Values are passed through `_param_value`.
+
+    Depth-first with a stack of iterators, so that keys keep their order
+    without recursing.
+    """
+    out_dic = {}
+    stack = [(None, iter(dic.items()))]
+    while stack:
+        prefix, items = stack[-1]
+        for k, v in items:
+            key = k if prefix is None else prefix + concat_sep + str(k)
+            if isinstance(v, dict):
+                # Resume `items` once the nested dict is exhausted
+                stack.append((str(key), iter(v.items())))
+                break
+            out_dic[key] = _param_value(v)
+        else:
+            stack.pop()
     return out_dic
 
 
+def _param_value(v):
+    """Functions are replaced by their source"""
+    if callable(v):
+        if isinstance(v, collections.abc.Hashable):
+            return _getsource(v)
+        return inspect.getsource(v)
+    return v
+
+
+@functools.lru_cache(maxsize=256)
+def _getsource(func) -> str:
+    """Cached inspect.getsource
+
+    The source lines are already cached by linecache; this skips finding and
+    tokenizing the function's block at each call. The cache holds strong
+    references to the callables, and returns stale source after a module
+    reload (see `clear_caches`).
+    """
+    return inspect.getsource(func)
+
+
+@functools.lru_cache(maxsize=8)
+def _client(tracking_uri: str) -> mlflow.tracking.MlflowClient:
+    """One MlflowClient per tracking uri, reused across calls"""
+    return mlflow.tracking.MlflowClient(tracking_uri=tracking_uri)
+
+
 def get_run_ids(experiment_id: str, max_results: int) -> list:
     """Get id of all runs associated to an experiment"""
     runs_info = mlflow.list_run_infos(
@@ -145,6 +276,43 @@ def get_run_ids(experiment_id: str, max_results: int) -> list:
     return runs_id
 
 
+def get_run_ids_wo_metric(
+    tracking_uri: str, experiment_id: str, key: str, max_results: int
+) -> list:
+    """Get id of all finished runs of an experiment where `key` is not logged
+
+    Runs are fetched with their metrics in a single search, rather than
+    checking each run with `check_metrics_exist`.
+
+    Parameters
+    ----------
+    tracking_uri: str
+        Folder in which experiments are stored
+    experiment_id : str
+        experiment_id
+    key : str
+        Metric name
+    max_results : int
+        Maximum number of runs to search
+
+    Returns
+    -------
+    list
+    """
+    client = _client(tracking_uri=tracking_uri)
+    runs = client.search_runs(
+        experiment_ids=[experiment_id],
+        run_view_type=mlflow.entities.ViewType.ACTIVE_ONLY,
+        max_results=max_results,
+    )
+    runs_id = [
+        run.info.run_id
+        for run in runs
+        if run.info.status == "FINISHED" and key not in run.data.metrics
+    ]
+    return runs_id
+
+
 def check_metrics_exist(tracking_uri: str, run_id: str, key: str) -> bool:
     """Check metric has been filled in the run
 
@@ -160,35 +328,105 @@ def check_metrics_exist(tracking_uri: str, run_id: str, key: str) -> bool:
     Returns
     -------
     bool
+        False also if the run does not exist.
+
+    Notes
+    -----
+    Metrics cannot be removed from a run, so positive answers are cached. Call
+    `clear_caches()` if runs get deleted.
     """
-    client = mlflow.tracking.MlflowClient(tracking_uri=tracking_uri)
-    try:
-        client.get_metric_history(run_id=run_id, key=key)
+    cache_key = (tracking_uri, run_id, key)
+    if cache_key in _found_metrics:
         return True
-    except Exception as e:
-        if isinstance(e, mlflow.exceptions.MlflowException):
-            return False
+    try:
+        run = _client(tracking_uri=tracking_uri).get_run(run_id=run_id)
+    except mlflow.exceptions.MlflowException:
+        # Unknown run
+        return False
+    metric_exists = key in run.data.metrics
+    if metric_exists:
+        _found_metrics.add(cache_key)
+    return metric_exists
+
+
+def log_json_artifact(
+    json_dict: dict, filename: str, with_fingerprint: bool = False
+) -> None:
+    """Avoid using mlflow.log_json which is considered experimental
+
+    If `with_fingerprint`, the sha256 of the canonical json is also logged, as
+    `filename` + ".sha256" (see `run_w_params_exists`). It is skipped, with a
+    warning, when the keys cannot be sorted.
+    """
+    json_str = json.dumps(obj=json_dict)
+    create_artifact_from_str(s=json_str, filename=filename)
+    if with_fingerprint:
+        fingerprint = _json_fingerprint(json_dict=json_dict)
+        if fingerprint is None:
+            logger.warning(
+                f"Keys of '{filename}' cannot be sorted, no fingerprint logged."
+            )
         else:
-            raise TypeError("mlflow has risen an unexpected exception.")
+            create_artifact_from_str(
+                s=fingerprint, filename=filename + _FINGERPRINT_SUFFIX
+            )
 
 
-def log_json_artifact(json_dict: dict, filename: str) -> None:
-    """Avoid using mlflow.log_json which is considered experimental"""
-    json_str = json.dumps(obj=json_dict)
-    create_artifact_from_str(s=json_str, filename=filename)
+def _json_fingerprint(json_dict: dict) -> Optional[str]:
+    """sha256 of the json, with sorted keys and no whitespace
+
+    None if keys cannot be sorted (e.g. dicts mixing int and str keys).
+    """
+    try:
+        json_str = json.dumps(
+            obj=json_dict, sort_keys=True, separators=(",", ":")
+        )
+    except TypeError:
+        return None
+    return hashlib.sha256(json_str.encode("utf-8")).hexdigest()
 
 
 def get_json_artifact(run_id: str, artifact_name: str) -> Union[list, dict]:
-    """Get json artifact"""
-    run = mlflow.get_run(run_id=run_id)
-    json_path = os.path.realpath(
-        os.path.join(run.info.artifact_uri, artifact_name)
+    """Get json artifact
+
+    The raw json is cached per (tracking uri, run, artifact), and parsed anew
+    at each call so that callers may mutate the output. Artifacts logged
+    through `create_artifact_from_str` clear the cache; call `clear_caches()`
+    after overwriting one by other means.
+    """
+    json_str = _read_artifact(
+        tracking_uri=mlflow.get_tracking_uri(),
+        run_id=run_id,
+        artifact_name=artifact_name,
     )
-    with open(json_path) as f:
-        artifact = json.load(f)
+    artifact = _json_loads(json_str)
     return artifact
 
 
+@functools.lru_cache(maxsize=4096)
+def _read_artifact(tracking_uri: str, run_id: str, artifact_name: str) -> str:
+    """Cached read. `tracking_uri` is only part of the key."""
+    run = mlflow.get_run(run_id=run_id)
+    artifact_path = os.path.join(run.info.artifact_uri, artifact_name)
+    with open(artifact_path) as f:
+        artifact_str = f.read()
+    return artifact_str
+
+
+def _json_loads(json_str: str) -> Union[list, dict]:
+    """Parse with orjson if installed, else with json
+
+    json also accepts the NaN/Infinity tokens that json.dumps may write, which
+    orjson rejects.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(json_str)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(json_str)
+
+
 def get_run_params(run_id: str) -> dict:
     """
     Get parameters associated to an mlflow run
@@ -196,14 +434,23 @@ def get_run_params(run_id: str) -> dict:
     NOTE: this will retrieve the parameters from the params slot of mlflow
     (which str-ify all parameters). Consider storing and loading parameters
     from a json instead.
+
+    Params of finished runs are cached per tracking uri, as no param can be
+    logged to them anymore. Runs still active may log new params, so they are
+    fetched anew at each call. A copy is returned.
     """
+    cache_key = (mlflow.get_tracking_uri(), run_id)
+    if cache_key in _finished_runs_params:
+        return dict(_finished_runs_params[cache_key])
     run = mlflow.get_run(run_id=run_id)
     params = run.data.params
+    if run.info.status == "FINISHED":
+        _finished_runs_params[cache_key] = dict(params)
     return params
 
 
 def get_json_artifact_for_all_runs(
-    experiment_id: str, artifact_name: str
+    experiment_id: str, artifact_name: str, max_workers: int = 16
 ) -> Dict[str, dict]:
     """
     Get json artifact associated to each run in a experiment
@@ -219,23 +466,22 @@ def get_json_artifact_for_all_runs(
     artifact_name: str
         Name of the artifact (as was saved beforehand)
 
+    max_workers: int
+        Number of threads fetching artifacts concurrently (fetching is I/O
+        bound)
+
     Returns
     -------
     Dict[str, dict]
         dict with keys run id, values parameters
     """
-    runs_info = mlflow.list_run_infos(
-        experiment_id=experiment_id,
-        run_view_type=mlflow.entities.ViewType.ACTIVE_ONLY,
-        max_results=1000000,
+    run_ids = get_run_ids(experiment_id=experiment_id, max_results=1000000)
+    get_artifact = functools.partial(
+        get_json_artifact, artifact_name=artifact_name
     )
-    all_artifacts = {}
-    for run_info in runs_info:
-        run_id = run_info.run_id
-        # If status is FINISHED, then fetch the params
-        if run_info.status == "FINISHED":
-            artifact = get_json_artifact(
-                run_id=run_id, artifact_name=artifact_name
-            )
-            all_artifacts[run_id] = artifact
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers
+    ) as executor:
+        artifacts = executor.map(get_artifact, run_ids)
+        all_artifacts = dict(zip(run_ids, artifacts))
     return all_artifacts
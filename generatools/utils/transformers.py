@@ -1,6 +1,5 @@
 import transformers
 import torch
-import gc
 
 
 def load_tokenizer_model(
@@ -30,6 +29,5 @@ def load_tokenizer_model(
         tokenizer_name
     )
     model = getattr(transformers, model_class).from_pretrained(model_name)
-    gc.collect()
     model = model.to(device)
     return tokenizer, model
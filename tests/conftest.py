@@ -1,4 +1,8 @@
+import json
 import pytest
+import torch
+import transformers as trf
+from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
 
 collect_ignore = ["setup.py"]
 
@@ -21,3 +25,52 @@ def pytest_collection_modifyitems(config, items):
     for item in items:
         if "slow" in item.keywords:
             item.add_marker(skip_slow)
+
+
+@pytest.fixture(scope="session")
+def distilgpt2_tokenizer():
+    """Tokenizer shared by all tests (tests must not modify it)"""
+    return trf.GPT2Tokenizer.from_pretrained(
+        "distilgpt2",
+        pad_token="<|pad|>",
+        special_bos="<|spec_bos|>",
+        special_eos="<|spec_eos|>",
+    )
+
+
+@pytest.fixture(scope="session")
+def local_gpt2_tokenizer(tmp_path_factory):
+    """Byte-level GPT2 tokenizer without merges, built without the hub
+
+    One token per byte, so that tests not needing real tokens can run by
+    default (tests must not modify it).
+    """
+    dirpath = tmp_path_factory.mktemp("local_gpt2_tokenizer")
+    vocab = {"<|endoftext|>": 0}
+    for char in bytes_to_unicode().values():
+        vocab[char] = len(vocab)
+    vocab_file = dirpath / "vocab.json"
+    vocab_file.write_text(json.dumps(vocab), encoding="utf-8")
+    merges_file = dirpath / "merges.txt"
+    merges_file.write_text("#version: 0.2\n", encoding="utf-8")
+    return trf.GPT2Tokenizer(
+        vocab_file=str(vocab_file),
+        merges_file=str(merges_file),
+        pad_token="<|pad|>",
+    )
+
+
+@pytest.fixture(scope="session")
+def local_gpt2_model(local_gpt2_tokenizer):
+    """Tiny randomly initialised GPT2, matching `local_gpt2_tokenizer`"""
+    torch.manual_seed(0)
+    config = trf.GPT2Config(
+        vocab_size=len(local_gpt2_tokenizer),
+        n_positions=64,
+        n_embd=16,
+        n_layer=2,
+        n_head=2,
+        bos_token_id=local_gpt2_tokenizer.bos_token_id,
+        eos_token_id=local_gpt2_tokenizer.eos_token_id,
+    )
+    return trf.GPT2LMHeadModel(config).eval()
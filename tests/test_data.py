@@ -1,5 +1,7 @@
+import numpy as np
+import os
 import pytest
-import transformers as trf
+import tempfile
 import unittest
 import torch.utils.data
 
@@ -11,13 +13,12 @@ class TestGPTDataset(unittest.TestCase):
     Test the torch.utils.data.Dataset child for GPT-like data.
     """
 
+    @pytest.fixture(autouse=True)
+    def _set_tokenizer(self, distilgpt2_tokenizer):
+        """Runs before setUp"""
+        self.tokenizer = distilgpt2_tokenizer
+
     def setUp(self):
-        self.tokenizer = trf.GPT2Tokenizer.from_pretrained(
-            "distilgpt2",
-            pad_token="<|pad|>",
-            special_bos="<|spec_bos|>",
-            special_eos="<|spec_eos|>",
-        )
         self.texts = [
             "I am Will Smith",
             "I love cow boys and I'm Prince of Bel Air",
@@ -114,19 +115,63 @@ class TestGPTDataset(unittest.TestCase):
         assert exp_lens == obs_lens
 
 
+class TestGPTDatasetStorage(unittest.TestCase):
+    """
+    Saving, loading and caching of GPTDataset, with a tokenizer built locally.
+    """
+
+    @pytest.fixture(autouse=True)
+    def _set_tokenizer(self, local_gpt2_tokenizer):
+        """Runs before setUp"""
+        self.tokenizer = local_gpt2_tokenizer
+
+    def setUp(self):
+        self.texts = [
+            "I am Will Smith",
+            "I love cow boys and I'm Prince of Bel Air",
+            "Hey",
+        ]
+
+    def test_save_load_roundtrip(self):
+        dataset = data.GPTDataset(texts=self.texts, tokenizer=self.tokenizer)
+        with tempfile.TemporaryDirectory() as dirpath:
+            dataset.save_to_disk(dirpath)
+            loaded = data.GPTDataset.load_from_disk(dirpath)
+            assert len(loaded) == len(dataset)
+            for doc, loaded_doc in zip(dataset, loaded):
+                assert isinstance(loaded_doc["input_ids"], np.memmap)
+                for k in ["input_ids", "attention_mask"]:
+                    assert doc[k].tolist() == loaded_doc[k].tolist()
+
+    def test_cache_reused(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            dataset = data.GPTDataset(
+                texts=self.texts, tokenizer=self.tokenizer, cache_dir=cache_dir
+            )
+            cached = data.GPTDataset(
+                texts=self.texts, tokenizer=self.tokenizer, cache_dir=cache_dir
+            )
+            # A single cache entry, without leftover temporary dir
+            assert len(os.listdir(cache_dir)) == 1
+            assert not isinstance(dataset[0]["input_ids"], np.memmap)
+            assert isinstance(cached[0]["input_ids"], np.memmap)
+            assert [d["input_ids"].tolist() for d in cached] == [
+                d["input_ids"].tolist() for d in dataset
+            ]
+
+
 class TestDataLoader(unittest.TestCase):
     """
     Integration of data.GPTDataset + data.gpttokenizer_collate_fn in pytorch
     dataloader
     """
 
+    @pytest.fixture(autouse=True)
+    def _set_tokenizer(self, distilgpt2_tokenizer):
+        """Runs before setUp"""
+        self.tokenizer = distilgpt2_tokenizer
+
     def setUp(self):
-        self.tokenizer = trf.GPT2Tokenizer.from_pretrained(
-            "distilgpt2",
-            pad_token="<|pad|>",
-            special_bos="<|spec_bos|>",
-            special_eos="<|spec_eos|>",
-        )
         self.texts = [
             "I am Will Smith",
             "I love cow boys and I'm Prince of Bel Air",
@@ -166,6 +211,44 @@ class TestDataLoader(unittest.TestCase):
         )
 
 
+class TestCollate(unittest.TestCase):
+    """
+    Test data.gpttokenizer_collate_fn on docs of different lengths
+    """
+
+    def setUp(self):
+        self.dicts_list = [
+            {"input_ids": np.array([1, 2, 3]), "attention_mask": np.ones(3)},
+            {"input_ids": np.array([4]), "attention_mask": np.ones(1)},
+        ]
+
+    def test_ragged_docs_padded(self):
+        out = data.gpttokenizer_collate_fn(self.dicts_list, pad_token_id=9)
+        assert out["input_ids"].tolist() == [[1, 2, 3], [4, 9, 9]]
+        assert out["attention_mask"].tolist() == [[1, 1, 1], [1, 0, 0]]
+        assert out["labels"].tolist() == out["input_ids"].tolist()
+
+    def test_padded_labels_masked(self):
+        out = data.gpttokenizer_collate_fn(
+            self.dicts_list, pad_token_id=9, mask_padded_labels=True
+        )
+        assert out["labels"].tolist() == [[1, 2, 3], [4, -100, -100]]
+
+    def test_ragged_docs_need_pad_token_id(self):
+        self.assertRaises(
+            ValueError, data.gpttokenizer_collate_fn, self.dicts_list
+        )
+
+    def test_same_length_docs_need_no_pad_token_id(self):
+        dicts_list = [
+            {"input_ids": np.array([1, 2]), "attention_mask": np.ones(2)},
+            {"input_ids": np.array([4, 5]), "attention_mask": np.ones(2)},
+        ]
+        out = data.gpttokenizer_collate_fn(dicts_list)
+        assert out["input_ids"].tolist() == [[1, 2], [4, 5]]
+        assert out["labels"].tolist() == [[1, 2], [4, 5]]
+
+
 class DummyDataset(torch.utils.data.Dataset):
     """
     For testing data.splitter
@@ -201,7 +284,9 @@ class TestSplitter(unittest.TestCase):
             train_subsample_prop=1,
             seed=1,
         )
-        assert splits_1 == splits_2
+        assert [list(split) for split in splits_1] == [
+            list(split) for split in splits_2
+        ]
 
     def test_subsample_train_works(self):
         splits_subsamble = data.splitter(
@@ -228,4 +313,6 @@ class TestSplitter(unittest.TestCase):
             train_subsample_prop=1 / 3,
             seed=1,
         )
-        assert splits_1[1:] == splits_subsamble[1:]
+        assert [list(split) for split in splits_1[1:]] == [
+            list(split) for split in splits_subsamble[1:]
+        ]
@@ -0,0 +1,82 @@
+import pytest
+import torch
+import unittest
+import unittest.mock
+
+from generatools import genseqs
+
+
+class TestGenSeqsFromPrompts(unittest.TestCase):
+    """
+    Test batched generation, with a tiny GPT2 and tokenizer built locally.
+    """
+
+    @pytest.fixture(autouse=True)
+    def _set_tokenizer_model(self, local_gpt2_tokenizer, local_gpt2_model):
+        """Runs before setUp"""
+        self.tokenizer = local_gpt2_tokenizer
+        self.model = local_gpt2_model
+
+    def setUp(self):
+        self.device = torch.device("cpu")
+        self.prompts = ["ab", "wxyz", "abc"]
+
+    def gen(self, prompts, **kwargs):
+        """Greedy generation (top_k=1), so that outputs are deterministic"""
+        return genseqs.gen_seqs_from_prompts(
+            prompts=prompts,
+            model=self.model,
+            tokenizer=self.tokenizer,
+            max_length_after_prompt=5,
+            num_return_sequences=2,
+            device=self.device,
+            seed=0,
+            top_k=1,
+            **kwargs,
+        )
+
+    def test_prompts_left_padded(self):
+        input_ids, attention_mask = genseqs._encode_prompts(
+            prompts=("ab", "wxyz"),
+            tokenizer=self.tokenizer,
+            device=self.device,
+        )
+        pad_id = self.tokenizer.pad_token_id
+        exp_ids = [
+            [pad_id, pad_id] + self.tokenizer.encode("ab"),
+            self.tokenizer.encode("wxyz"),
+        ]
+        self.assertEqual(input_ids.tolist(), exp_ids)
+        self.assertEqual(attention_mask.tolist(), [[0, 0, 1, 1], [1, 1, 1, 1]])
+
+    def test_sequences_grouped_by_prompt(self):
+        sequences_list = self.gen(prompts=self.prompts)
+        self.assertEqual(len(sequences_list), len(self.prompts))
+        for prompt, sequences in zip(self.prompts, sequences_list):
+            self.assertEqual(len(sequences), 2)
+            for sequence in sequences:
+                self.assertTrue(sequence.startswith(prompt))
+
+    def test_padding_does_not_change_outputs(self):
+        batched = self.gen(prompts=self.prompts, batch_size=None)
+        alone = [self.gen(prompts=[prompt])[0] for prompt in self.prompts]
+        self.assertEqual(batched, alone)
+
+    def test_prompts_chunked_in_batches(self):
+        # 2 sequences per prompt, thus 2 prompts per call
+        with unittest.mock.patch.object(
+            self.model, "generate", wraps=self.model.generate
+        ) as generate:
+            batched = self.gen(prompts=self.prompts, batch_size=4)
+        self.assertEqual(generate.call_count, 2)
+        self.assertEqual(batched, self.gen(prompts=self.prompts))
+
+    def test_sequences_of_a_prompt_split_over_calls(self):
+        with unittest.mock.patch.object(
+            self.model, "generate", wraps=self.model.generate
+        ) as generate:
+            batched = self.gen(prompts=self.prompts, batch_size=1)
+        self.assertEqual(generate.call_count, 2 * len(self.prompts))
+        for _, call_kwargs in generate.call_args_list:
+            self.assertEqual(call_kwargs["num_return_sequences"], 1)
+        self.assertEqual(batched, self.gen(prompts=self.prompts))
@@ -0,0 +1,30 @@
+import unittest
+
+from generatools import hyperopt
+
+
+class TestIterGridFromConf(unittest.TestCase):
+    def test_same_grid_as_parameter_grid(self):
+        conf = {
+            "temperature": [0.5, 1.0],
+            "intro": ["a", "b", "c"],
+            "top_k": [10],
+            "examples": [{"kws": [["x"]], "txts": []}],
+        }
+        exp_out = list(hyperopt.generate_grid_from_conf(conf=conf))
+        obs_out = list(hyperopt.iter_grid_from_conf(conf=conf))
+        self.assertEqual(exp_out, obs_out)
+
+    def test_raise_on_scalar_values(self):
+        for values in ["Generate sentences", b"Generate sentences", 3]:
+            with self.subTest(values=values):
+                self.assertRaises(
+                    TypeError,
+                    hyperopt.iter_grid_from_conf,
+                    conf={"top_k": [10], "intro": values},
+                )
+
+    def test_raise_on_empty_values(self):
+        self.assertRaises(
+            ValueError, hyperopt.iter_grid_from_conf, conf={"intro": []}
+        )
@@ -1,6 +1,10 @@
 import unittest
 import pytest
-from generatools.preproc import prompt_formatter, make_prompt_w_keywords_new
+from generatools.preproc import (
+    prompt_formatter,
+    make_prompt_formatter,
+    make_prompt_w_keywords_new,
+)
 
 
 class TestPromptFormatter(unittest.TestCase):
@@ -132,3 +136,48 @@ def test_make_prompt_w_keywords_new():
     )
     exp_out = "hey Jude\ndon't be"
     assert exp_out == obs_out
+
+
+def test_make_prompt_formatter():
+    format_prompt = make_prompt_formatter(
+        ex_sep="[exsep]",
+        ex_add_numeral=True,
+        ex_num_lhs="[prenum]",
+        ex_num_rhs="[postnum]",
+        ex_kws_lhs="[kwlhs]",
+        ex_kws_sep="[kwsep]",
+        ex_kws_rhs="[kwrhs]",
+        ex_txts_lhs="[txtlhs]",
+        ex_txts_rhs="[txtrhs]",
+    )
+    # The same formatter, reused across contents
+    obs_out = format_prompt(
+        intro="[intro]",
+        kws=[["hey", "lad"], ["how"]],
+        txts=["I'm a cow"],
+    )
+    exp_out = (
+        "[intro]"
+        "[prenum]1[postnum][kwlhs]hey[kwsep]lad[kwrhs][txtlhs]I'm a cow[txtrhs]"
+        "[exsep]"
+        "[prenum]2[postnum][kwlhs]how[kwrhs][txtlhs]"
+    )
+    assert exp_out == obs_out
+    obs_out = format_prompt(kws=[["are", "you"], ["ok"]], txts=["mooh"])
+    exp_out = (
+        "[prenum]1[postnum][kwlhs]are[kwsep]you[kwrhs][txtlhs]mooh[txtrhs]"
+        "[exsep]"
+        "[prenum]2[postnum][kwlhs]ok[kwrhs][txtlhs]"
+    )
+    assert exp_out == obs_out
+
+
+def test_make_prompt_w_keywords_new_w_format_prompt():
+    obs_out = make_prompt_w_keywords_new(
+        kws=[["hey "]],
+        txts=["Jude"],
+        keywords_new=["don't ", "be"],
+        format_prompt=make_prompt_formatter(ex_sep="\n"),
+    )
+    exp_out = "hey Jude\ndon't be"
+    assert exp_out == obs_out
@@ -1,3 +1,6 @@
+import io
+import json
+import statistics
 import unittest
 import generatools.sequences as sequences
 
@@ -32,20 +35,15 @@ class TestPromptSeqsPairSequences(unittest.TestCase):
         z.prompt = "bla"
 
     def test_except_if_improper_prompt_lvl_eval(self):
-        self.assertRaises(
-            TypeError,
-            sequences.PromptSeqsPair,
-            prompt="bla",
-            sequences=["aa", "bb"],
-            prompt_lvl_eval=[2, 3],
-        )
-        self.assertRaises(
-            TypeError,
-            sequences.PromptSeqsPair,
-            prompt="bla",
-            sequences=["aa", "bb"],
-            prompt_lvl_eval={"metric1": [2, 3]},
-        )
+        for prompt_lvl_eval in [[2, 3], {"metric1": [2, 3]}]:
+            with self.subTest(prompt_lvl_eval=prompt_lvl_eval):
+                self.assertRaises(
+                    TypeError,
+                    sequences.PromptSeqsPair,
+                    prompt="bla",
+                    sequences=["aa", "bb"],
+                    prompt_lvl_eval=prompt_lvl_eval,
+                )
 
     def test_run_if_proper_seq_lvl_eval(self):
         sequences.PromptSeqsPair(
@@ -55,23 +53,22 @@ class TestPromptSeqsPairSequences(unittest.TestCase):
         )
 
     def test_except_if_improper_seq_lvl_eval(self):
-        self.assertRaises(
-            TypeError,
-            sequences.PromptSeqsPair,
-            prompt="bla",
-            sequences=["aa", "bb"],
-            seq_lvl_eval=[
-                {"metric1": 2, "metric2": 3},
-                {"metric1": 2, "metric2": 3},
-            ],
-        )
-        self.assertRaises(
-            ValueError,
-            sequences.PromptSeqsPair,
-            prompt="bla",
-            sequences=["aa", "bb"],
-            seq_lvl_eval={"metric1": [2, 3], "metric2": [3]},
-        )
+        cases = [
+            (
+                TypeError,
+                [{"metric1": 2, "metric2": 3}, {"metric1": 2, "metric2": 3}],
+            ),
+            (ValueError, {"metric1": [2, 3], "metric2": [3]}),
+        ]
+        for exception, seq_lvl_eval in cases:
+            with self.subTest(seq_lvl_eval=seq_lvl_eval):
+                self.assertRaises(
+                    exception,
+                    sequences.PromptSeqsPair,
+                    prompt="bla",
+                    sequences=["aa", "bb"],
+                    seq_lvl_eval=seq_lvl_eval,
+                )
 
     def test_to_dict_generates_a_dict(self):
         obs_out = sequences.PromptSeqsPair(
@@ -89,6 +86,21 @@ class TestPromptSeqsPairSequences(unittest.TestCase):
         ).average_seq_lvl_eval()
         self.assertEqual(exp_out, obs_out)
 
+    def test_average_seq_lvl_eval_w_one_seq(self):
+        obs_out = sequences.PromptSeqsPair(
+            prompt="bla", sequences=["aa"], seq_lvl_eval={"m1": [1]}
+        ).average_seq_lvl_eval()
+        self.assertEqual({"m1": 1.0}, obs_out)
+        self.assertIsInstance(obs_out["m1"], float)
+
+    def test_average_seq_lvl_eval_fails_wo_seq(self):
+        pair = sequences.PromptSeqsPair(
+            prompt="bla", sequences=[], seq_lvl_eval={"m1": []}
+        )
+        self.assertRaises(
+            statistics.StatisticsError, pair.average_seq_lvl_eval
+        )
+
 
 class TestPromptSeqsPairsList(unittest.TestCase):
     def test_setting_retrieving_works(self):
@@ -170,6 +182,50 @@ class TestPromptSeqsPairsList(unittest.TestCase):
         obs_out = pair_list.average_seq_lvl_metrics()
         self.assertEqual(exp_out, obs_out)
 
+    def test_seq_lvl_averaging_works_w_various_nb_of_seqs(self):
+        ls = [
+            sequences.PromptSeqsPair(
+                prompt="a",
+                sequences=["y1", "y2"],
+                seq_lvl_eval={"m1": [1, 1], "m2": [10, 10]},
+            ),
+            sequences.PromptSeqsPair(
+                prompt="b",
+                sequences=["y1", "y2", "y3"],
+                seq_lvl_eval={"m1": [3, 3, 3], "m2": [20, 30, 40]},
+            ),
+        ]
+        pair_list = sequences.PromptSeqsPairsList(ls=ls)
+        exp_out = {"m1": 2, "m2": 20}
+        obs_out = pair_list.average_seq_lvl_metrics()
+        self.assertEqual(exp_out, obs_out)
+
+    def test_seq_lvl_averaging_fails_wo_seq(self):
+        ls = [
+            sequences.PromptSeqsPair(
+                prompt="a", sequences=["y1"], seq_lvl_eval={"m1": [1]}
+            ),
+            sequences.PromptSeqsPair(
+                prompt="b", sequences=[], seq_lvl_eval={"m1": []}
+            ),
+        ]
+        pair_list = sequences.PromptSeqsPairsList(ls=ls)
+        self.assertRaises(
+            statistics.StatisticsError, pair_list.average_seq_lvl_metrics
+        )
+
+    def test_seq_lvl_averaging_fails_when_no_pair_has_seqs(self):
+        ls = [
+            sequences.PromptSeqsPair(
+                prompt=prompt, sequences=[], seq_lvl_eval={"m1": []}
+            )
+            for prompt in ["a", "b"]
+        ]
+        pair_list = sequences.PromptSeqsPairsList(ls=ls)
+        self.assertRaises(
+            statistics.StatisticsError, pair_list.average_seq_lvl_metrics
+        )
+
     def test_to_json_works(self):
         ls = [
             sequences.PromptSeqsPair(
@@ -187,3 +243,22 @@ class TestPromptSeqsPairsList(unittest.TestCase):
         obs_out = pair_list.to_json()
         exp_out = [ls[0].to_dict(), ls[1].to_dict()]
         self.assertEqual(exp_out, obs_out)
+
+    def test_to_json_bytes_works(self):
+        ls = [
+            sequences.PromptSeqsPair(
+                prompt="a",
+                sequences=["y1", "y2"],
+                seq_lvl_eval={"m1": [1, 1], "m2": [10, 10]},
+            ),
+            sequences.PromptSeqsPair(
+                prompt="b",
+                sequences=["y1", "y2"],
+                seq_lvl_eval={"m1": [3, 1], "m2": [30, 10]},
+            ),
+        ]
+        pair_list = sequences.PromptSeqsPairsList(ls=ls)
+        fp = io.BytesIO()
+        obs_out = pair_list.to_json_bytes(fp=fp)
+        self.assertEqual(pair_list.to_json(), json.loads(obs_out))
+        self.assertEqual(obs_out, fp.getvalue())
@@ -0,0 +1,17 @@
+import mlflow
+import pytest
+
+
+@pytest.fixture(scope="session")
+def mlflow_run(tmp_path_factory):
+    """(tracking uri, run id) of a run created once per session
+
+    The run is created through a client, so that it does not become the active
+    run of tests calling mlflow.start_run.
+    """
+    tracking_uri = str(tmp_path_factory.mktemp("mlruns"))
+    client = mlflow.tracking.MlflowClient(tracking_uri=tracking_uri)
+    experiment_id = client.create_experiment(name="temp_expe")
+    run = client.create_run(experiment_id=experiment_id)
+    yield tracking_uri, run.info.run_id
+    client.set_terminated(run_id=run.info.run_id)
@@ -1,55 +1,273 @@
 import unittest
-import copy
 import mlflow
+import pytest
 import tempfile
 import shutil
+import time
 import generatools.utils.mlflow
 
 
 class MlflowTester(unittest.TestCase):
-    """Tester with setUp and tearDown creating an expe folder and deleting
-    it"""
+    """Tester giving each test its own expe folder
 
-    def setUp(self):
-        self.expes_uri = tempfile.mkdtemp()
+    Folders are created in a root shared by the class, deleted at once after
+    all tests ran.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.expes_root = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.expes_root)
 
-    def tearDown(self):
-        shutil.rmtree(self.expes_uri)
+    def setUp(self):
+        self.expes_uri = tempfile.mkdtemp(dir=self.expes_root)
 
 
-class TestMetricExist(MlflowTester):
+class TestMetricExist(unittest.TestCase):
     """
     Test type: private (implementation detail)
     """
 
+    @pytest.fixture(autouse=True)
+    def _set_run(self, mlflow_run):
+        self.expes_uri, self.run_id = mlflow_run
+
     def test_two_cases(self):
         """When metric already exists and when does not"""
         # Variables
+        metric_name = "temp_metric"
+        #  Core
+        self.assertFalse(
+            generatools.utils.mlflow.check_metrics_exist(
+                tracking_uri=self.expes_uri,
+                run_id=self.run_id,
+                key=metric_name,
+            )
+        )
+        # Logged as in grading, in a single batch
+        client = mlflow.tracking.MlflowClient(tracking_uri=self.expes_uri)
+        client.log_batch(
+            run_id=self.run_id,
+            metrics=[
+                mlflow.entities.Metric(
+                    key=metric_name,
+                    value=10,
+                    timestamp=int(time.time() * 1000),
+                    step=0,
+                )
+            ],
+        )
+        self.assertTrue(
+            generatools.utils.mlflow.check_metrics_exist(
+                tracking_uri=self.expes_uri,
+                run_id=self.run_id,
+                key=metric_name,
+            )
+        )
+
+    def test_unknown_run(self):
+        self.assertFalse(
+            generatools.utils.mlflow.check_metrics_exist(
+                tracking_uri=self.expes_uri,
+                run_id="0" * 32,
+                key="temp_metric",
+            )
+        )
+
+
+class TestRunIdsWoMetric(MlflowTester):
+    def test_only_runs_wo_metric(self):
         expe_name = "temp_expe"
-        run_id = "0"
         metric_name = "temp_metric"
-        #  Core
         mlflow.set_tracking_uri(uri=self.expes_uri)
         experiment_id = mlflow.create_experiment(name=expe_name)
         with mlflow.start_run(experiment_id=experiment_id) as run:
-            run_id = run.info.run_id
-            self.assertFalse(
-                generatools.utils.mlflow.check_metrics_exist(
-                    tracking_uri=self.expes_uri, run_id=run_id, key=metric_name
-                )
-            )
+            run_id_wo_metric = run.info.run_id
+        with mlflow.start_run(experiment_id=experiment_id):
             mlflow.log_metric(key=metric_name, value=10)
-            self.assertTrue(
-                generatools.utils.mlflow.check_metrics_exist(
-                    tracking_uri=self.expes_uri, run_id=run_id, key=metric_name
+        obs_run_ids = generatools.utils.mlflow.get_run_ids_wo_metric(
+            tracking_uri=self.expes_uri,
+            experiment_id=experiment_id,
+            key=metric_name,
+            max_results=10,
+        )
+        self.assertEqual(obs_run_ids, [run_id_wo_metric])
+
+
+class TestCreateExpe(MlflowTester):
+    def test_cached_id_refreshed_after_creation(self):
+        expe_name = "temp_expe"
+        mlflow.set_tracking_uri(uri=self.expes_uri)
+        self.assertIsNone(
+            generatools.utils.mlflow.get_expe_id(expe_name=expe_name)
+        )
+        experiment_id = generatools.utils.mlflow.create_expe(
+            expe_name=expe_name
+        )
+        self.assertEqual(
+            generatools.utils.mlflow.get_expe_id(expe_name=expe_name),
+            experiment_id,
+        )
+
+    def test_expe_created_by_other_means_is_found(self):
+        expe_name = "temp_expe"
+        mlflow.set_tracking_uri(uri=self.expes_uri)
+        self.assertIsNone(
+            generatools.utils.mlflow.get_expe_id(expe_name=expe_name)
+        )
+        experiment_id = mlflow.create_experiment(name=expe_name)
+        self.assertEqual(
+            generatools.utils.mlflow.get_expe_id(expe_name=expe_name),
+            experiment_id,
+        )
+
+
+class TestRunParams(MlflowTester):
+    def test_params_logged_mid_run_are_seen(self):
+        mlflow.set_tracking_uri(uri=self.expes_uri)
+        experiment_id = mlflow.create_experiment(name="temp_expe")
+        with mlflow.start_run(experiment_id=experiment_id) as run:
+            mlflow.log_param("a", 1)
+            self.assertEqual(
+                generatools.utils.mlflow.get_run_params(run.info.run_id),
+                {"a": "1"},
+            )
+            mlflow.log_param("b", 2)
+            self.assertEqual(
+                generatools.utils.mlflow.get_run_params(run.info.run_id),
+                {"a": "1", "b": "2"},
+            )
+        # Finished, hence cached: the output can be mutated safely
+        obs_out = generatools.utils.mlflow.get_run_params(run.info.run_id)
+        obs_out["c"] = "3"
+        self.assertEqual(
+            generatools.utils.mlflow.get_run_params(run.info.run_id),
+            {"a": "1", "b": "2"},
+        )
+
+
+class TestJsonArtifact(MlflowTester):
+    def test_overwritten_artifact_is_reread(self):
+        expe_name = "temp_expe"
+        artifact_name = "params.json"
+        mlflow.set_tracking_uri(uri=self.expes_uri)
+        experiment_id = mlflow.create_experiment(name=expe_name)
+        with mlflow.start_run(experiment_id=experiment_id) as run:
+            generatools.utils.mlflow.log_json_artifact(
+                json_dict={"i": 0}, filename=artifact_name
+            )
+            obs_out = generatools.utils.mlflow.get_json_artifact(
+                run_id=run.info.run_id, artifact_name=artifact_name
+            )
+            self.assertEqual(obs_out, {"i": 0})
+            # Mutating the output does not alter the cache
+            obs_out["i"] = 2
+            generatools.utils.mlflow.log_json_artifact(
+                json_dict={"i": 1}, filename=artifact_name
+            )
+        obs_out = generatools.utils.mlflow.get_json_artifact(
+            run_id=run.info.run_id, artifact_name=artifact_name
+        )
+        self.assertEqual(obs_out, {"i": 1})
+
+
+class TestJsonArtifactForAllRuns(MlflowTester):
+    def test_one_artifact_per_finished_run(self):
+        expe_name = "temp_expe"
+        artifact_name = "params.json"
+        mlflow.set_tracking_uri(uri=self.expes_uri)
+        experiment_id = mlflow.create_experiment(name=expe_name)
+        exp_out = {}
+        for i in range(3):
+            with mlflow.start_run(experiment_id=experiment_id) as run:
+                generatools.utils.mlflow.log_json_artifact(
+                    json_dict={"i": i}, filename=artifact_name
                 )
+            exp_out[run.info.run_id] = {"i": i}
+        obs_out = generatools.utils.mlflow.get_json_artifact_for_all_runs(
+            experiment_id=experiment_id,
+            artifact_name=artifact_name,
+            max_workers=2,
+        )
+        self.assertEqual(exp_out, obs_out)
+        self.assertTrue(
+            generatools.utils.mlflow.run_w_params_exists(
+                params={"i": 1},
+                experiment_id=experiment_id,
+                params_artifact_name=artifact_name,
+            )
+        )
+        self.assertFalse(
+            generatools.utils.mlflow.run_w_params_exists(
+                params={"i": 3},
+                experiment_id=experiment_id,
+                params_artifact_name=artifact_name,
+            )
+        )
+
+
+class TestRunWParamsExists(MlflowTester):
+    def test_with_and_wo_fingerprint(self):
+        expe_name = "temp_expe"
+        artifact_name = "params.json"
+        mlflow.set_tracking_uri(uri=self.expes_uri)
+        experiment_id = mlflow.create_experiment(name=expe_name)
+        with mlflow.start_run(experiment_id=experiment_id):
+            generatools.utils.mlflow.log_json_artifact(
+                json_dict={"a": 1, "b": {"c": 2}},
+                filename=artifact_name,
+                with_fingerprint=True,
+            )
+        with mlflow.start_run(experiment_id=experiment_id):
+            generatools.utils.mlflow.log_json_artifact(
+                json_dict={"a": 2}, filename=artifact_name
+            )
+        for params, exp_out in [
+            ({"b": {"c": 2}, "a": 1}, True),
+            ({"a": 1, "b": {"c": 3}}, False),
+            ({"a": 2}, True),
+        ]:
+            obs_out = generatools.utils.mlflow.run_w_params_exists(
+                params=params,
+                experiment_id=experiment_id,
+                params_artifact_name=artifact_name,
+            )
+            self.assertEqual(exp_out, obs_out)
+
+    def test_unsortable_keys_wo_fingerprint(self):
+        expe_name = "temp_expe"
+        artifact_name = "params.json"
+        mlflow.set_tracking_uri(uri=self.expes_uri)
+        experiment_id = mlflow.create_experiment(name=expe_name)
+        with mlflow.start_run(experiment_id=experiment_id) as run:
+            generatools.utils.mlflow.log_json_artifact(
+                json_dict={"a": {1: "x", "b": "y"}},
+                filename=artifact_name,
+                with_fingerprint=True,
+            )
+        client = mlflow.tracking.MlflowClient(tracking_uri=self.expes_uri)
+        artifacts = client.list_artifacts(run_id=run.info.run_id)
+        self.assertEqual([artifact_name], [a.path for a in artifacts])
+        # Matching falls back to the full json comparison
+        for params, exp_out in [
+            ({"a": {"1": "x", "b": "y"}}, True),
+            ({"a": {1: "x", "b": "y"}}, False),
+        ]:
+            obs_out = generatools.utils.mlflow.run_w_params_exists(
+                params=params,
+                experiment_id=experiment_id,
+                params_artifact_name=artifact_name,
             )
+            self.assertEqual(exp_out, obs_out)
 
 
 class TestDictToMlflowParams(unittest.TestCase):
     def test_depth_1_dic(self):
         dic = {"k1": "v1", "k2": "v2"}
-        exp_out = copy.deepcopy(dic)
+        exp_out = dict(dic)
         obs_out = generatools.utils.mlflow.dict_to_mlflow_params(dic=dic)
         self.assertEqual(exp_out, obs_out)
 